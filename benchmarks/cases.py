@@ -0,0 +1,87 @@
+import folium
+from data.store import DatasetStore
+from layers import builders, station_markers
+
+# map state the layer branches are measured with, like the defaults of the app
+MAP_ZOOM = 14
+RADIUS = 300
+WATER_DISTANCE = 100
+HOUR = 12
+NEAREST = 3
+DENSITY = "Gesamt"
+
+
+def load_data(datasets):
+    # building the store and the swiss frames every branch reads
+    store = DatasetStore(datasets)
+    for name in store:
+        store[name].swiss
+    return store
+
+
+def stadtgrenze(store):
+    return [folium.GeoJson(builders.city_boundary(store).payload)]
+
+
+def kantonsgrenze(store):
+    return [folium.GeoJson(builders.canton_boundary(store, MAP_ZOOM).payload)]
+
+
+def stationen(store):
+    lat, lon = builders.stations(store).payload
+    return [station_markers(lat, lon, icon="data/images/nextbike_icon_blue.png")]
+
+
+def station_umkreis(store):
+    return [folium.GeoJson(builders.coverage(store, RADIUS).payload)]
+
+
+def naechste_station(store):
+    stations = store["unique_stations"].wgs84
+    lon, lat = stations["lon"].mean(), stations["lat"].mean()
+    layers = [folium.Marker([lat, lon])]
+    for _, row in builders.nearest_stations(store, lon, lat, k=NEAREST).payload.iterrows():
+        layers.append(folium.Marker([row["lat"], row["lon"]], popup=row["name"]))
+        layers.append(folium.PolyLine([[lat, lon], [row["lat"], row["lon"]]]))
+    return layers
+
+
+def quartiere(store):
+    return [folium.GeoJson(builders.districts(store).payload)]
+
+
+def gewaesser(store):
+    return [folium.GeoJson(builders.water(store, MAP_ZOOM).payload)]
+
+
+def station_in_gewaesser_naehe(store):
+    return [folium.GeoJson(builders.stations_near_water(store, WATER_DISTANCE).payload)]
+
+
+def bevoelkerungsdichte(store):
+    return [folium.GeoJson(builders.density(store, DENSITY).payload)]
+
+
+def bevoelkerungsdichte_stationen(store):
+    return [folium.GeoJson(builders.residents_per_station(store).payload)]
+
+
+def verfuegbarkeit_fahrraeder(store):
+    return [folium.GeoJson(builders.availability(store, HOUR).payload)]
+
+
+# the layer branches of streamlit.py, by the name of their menu entry, measured
+# through the same builders the app uses
+LAYER_CASES = {
+    "Stadtgrenze": stadtgrenze,
+    "Kantonsgrenze": kantonsgrenze,
+    "Stationen": stationen,
+    "Station-Umkreis": station_umkreis,
+    "Nächste-Station": naechste_station,
+    "Quartiere": quartiere,
+    "Gewässer": gewaesser,
+    "Station-in-Gewässer-Nähe": station_in_gewaesser_naehe,
+    "Bevölkerungsdichte": bevoelkerungsdichte,
+    "Bevölkerungsdichte-Stationen": bevoelkerungsdichte_stationen,
+    "Verfügbarkeit-Fahrräder": verfuegbarkeit_fahrraeder,
+}
@@ -0,0 +1,225 @@
+"""
+Benchmarks the data layer and the map layer branches of the app.
+
+    python -m benchmarks.run --cities 1 4 16 --output results.json
+    python -m benchmarks.run --cities 1 4 16 --compare results.json
+
+Every layer is measured on synthetic datasets of the given number of cities:
+the first call on a new store (cold, with the indexes and cached payloads
+built), a second call (warm, as on a rerun), the folium rendering, the peak
+Python memory of a cold call and the size of the layer in the map HTML.
+With --dispatch the `sharedmobility()` queries of the configured backend are
+timed as well, e.g. with SHAREDMOBILITY_BACKEND=duckdb on local fixtures.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import folium
+from benchmarks.cases import LAYER_CASES, MAP_ZOOM, load_data
+from benchmarks.synthetic import synthetic_datasets, STATIONS_PER_CITY
+
+# relative slowdown or growth reported as regression by --compare
+REGRESSION_THRESHOLD = 0.1
+
+# the metrics compared between two runs, lower is better
+COMPARED_METRICS = ["cold_time", "warm_time", "render_time", "peak_memory", "payload_bytes"]
+
+DISPATCH_TYPES = [
+    "city_boundary",
+    "districts_and_stations",
+    "lakes_and_rivers",
+    "unique_stations",
+    "canton_boundary",
+    "stations_and_bikes",
+]
+
+
+def render(layers):
+    m = folium.Map(location=[47.05048, 8.30635], zoom_start=MAP_ZOOM)
+    for layer in layers:
+        layer.add_to(m)
+    return m.get_root().render()
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def peak_memory(func, *args):
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_load_data(datasets, repeat):
+    times = [timed(load_data, datasets)[0] for _ in range(repeat)]
+    return {
+        "cold_time": statistics.median(times),
+        "warm_time": None,
+        "render_time": None,
+        "peak_memory": peak_memory(load_data, datasets),
+        "payload_bytes": None,
+    }
+
+
+def bench_layer(case, datasets, repeat, empty_map):
+    cold, warm, render_times = [], [], []
+    for _ in range(repeat):
+        store = load_data(datasets)
+        elapsed, layers = timed(case, store)
+        cold.append(elapsed)
+        elapsed, layers = timed(case, store)
+        warm.append(elapsed)
+        elapsed, html = timed(render, layers)
+        render_times.append(elapsed)
+
+    store = load_data(datasets)
+    return {
+        "cold_time": statistics.median(cold),
+        "warm_time": statistics.median(warm),
+        "render_time": statistics.median(render_times),
+        "peak_memory": peak_memory(case, store),
+        "payload_bytes": len(html.encode("utf-8")) - empty_map,
+    }
+
+
+def bench_dispatch(repeat):
+    from data import sharedmobility
+    from data.cache import get_cache, set_cache
+
+    # the queries themselves are measured, not the result cache
+    cache = get_cache()
+    set_cache(None)
+    try:
+        results = []
+        for query_type in DISPATCH_TYPES:
+            times = [timed(sharedmobility, query_type)[0] for _ in range(repeat)]
+            results.append(
+                {
+                    "case": f"sharedmobility:{query_type}",
+                    "cities": None,
+                    "cold_time": statistics.median(times),
+                    "warm_time": None,
+                    "render_time": None,
+                    "peak_memory": peak_memory(sharedmobility, query_type),
+                    "payload_bytes": None,
+                }
+            )
+            print(format_result(results[-1]))
+        return results
+    finally:
+        set_cache(cache)
+
+
+def run(cities, repeat=3, stations_per_city=STATIONS_PER_CITY, cases=None, dispatch=False):
+    """
+    Returns the benchmark report as dict, see the module docstring.
+    """
+    empty_map = len(render([]).encode("utf-8"))
+    results = []
+    for n in cities:
+        datasets = synthetic_datasets(n, stations_per_city)
+        results.append({"case": "load_data", "cities": n, **bench_load_data(datasets, repeat)})
+        print(format_result(results[-1]))
+        for name, case in LAYER_CASES.items():
+            if cases and name not in cases:
+                continue
+            result = bench_layer(case, datasets, repeat, empty_map)
+            results.append({"case": name, "cities": n, **result})
+            print(format_result(results[-1]))
+    if dispatch:
+        results.extend(bench_dispatch(repeat))
+
+    return {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "stations_per_city": stations_per_city,
+        "results": results,
+    }
+
+
+def format_result(result):
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.1f}ms"
+
+    payload = result["payload_bytes"]
+    return (
+        f"{result['case']:<30} cities={result['cities']!s:<4} "
+        f"cold={ms(result['cold_time']):<10} warm={ms(result['warm_time']):<10} "
+        f"render={ms(result['render_time']):<10} "
+        f"peak={result['peak_memory'] / 1024**2:.1f}MB "
+        f"payload={'-' if payload is None else f'{payload / 1024:.1f}KB'}"
+    )
+
+
+def compare(report, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Compares two reports case by case.
+
+    Returns:
+    list: (case, cities, metric, baseline, current, ratio) of every metric
+        that grew by more than `threshold`.
+    """
+    previous = {(r["case"], r["cities"]): r for r in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        old = previous.get((result["case"], result["cities"]))
+        if old is None:
+            continue
+        for metric in COMPARED_METRICS:
+            before, after = old.get(metric), result.get(metric)
+            if not before or after is None:
+                continue
+            ratio = after / before
+            print(
+                f"{result['case']:<30} cities={result['cities']!s:<4} "
+                f"{metric:<14} {before:>12.4g} -> {after:<12.4g} {ratio:6.2f}x"
+            )
+            if ratio > 1 + threshold:
+                regressions.append(
+                    (result["case"], result["cities"], metric, before, after, ratio)
+                )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cities", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--stations", type=int, default=STATIONS_PER_CITY, help="stations per city")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--case", action="append", help="only run this layer, can be repeated")
+    parser.add_argument("--dispatch", action="store_true", help="also time the sharedmobility() queries")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    parser.add_argument("--compare", help="JSON report of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    report = run(args.cities, args.repeat, args.stations, args.case, args.dispatch)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for case, cities, metric, before, after, ratio in regressions:
+            print(f"REGRESSION {case} cities={cities} {metric}: {before:.4g} -> {after:.4g} ({ratio:.2f}x)")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
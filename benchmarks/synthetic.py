@@ -0,0 +1,136 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+from data.crs import EPSG_GLOBAL, EPSG_SWISS
+
+# lower left corner of the first city in the swiss CRS, about Luzern
+ORIGIN = (2662000, 1208000)
+
+# side of a city and gap between two cities, in meters
+CITY_SIZE = 6000
+CITY_SPACING = 20000
+
+DISTRICTS_PER_SIDE = 5
+STATIONS_PER_CITY = 150
+
+
+def city_origins(cities):
+    """
+    Lower left corners of `cities` cities laid out on a square grid.
+    """
+    per_row = int(np.ceil(np.sqrt(cities)))
+    return [
+        (ORIGIN[0] + (i % per_row) * CITY_SPACING, ORIGIN[1] + (i // per_row) * CITY_SPACING)
+        for i in range(cities)
+    ]
+
+
+def _frame(data, geometry):
+    return gpd.GeoDataFrame(data, geometry=geometry, crs=EPSG_SWISS).to_crs(crs=EPSG_GLOBAL)
+
+
+def synthetic_datasets(cities=1, stations_per_city=STATIONS_PER_CITY, seed=0):
+    """
+    Builds datasets with the names and columns `load_data` returns, for
+    `cities` square cities side by side. Each city has a grid of districts,
+    randomly placed stations, a river crossing it and a lake at its edge.
+
+    Returns:
+    dict: Dataset name -> GeoDataFrame in WGS84.
+    """
+    rng = np.random.default_rng(seed)
+    origins = city_origins(cities)
+
+    boundaries = [
+        shapely.box(x, y, x + CITY_SIZE, y + CITY_SIZE) for x, y in origins
+    ]
+    city_boundary = _frame(None, [shapely.union_all(boundaries)])
+    canton_boundary = _frame(
+        {"name": ["Kanton"]},
+        [shapely.union_all(boundaries).envelope.buffer(CITY_SPACING / 4)],
+    )
+
+    # districts on a regular grid inside every city
+    step = CITY_SIZE / DISTRICTS_PER_SIDE
+    districts = []
+    for c, (x, y) in enumerate(origins):
+        for i in range(DISTRICTS_PER_SIDE):
+            for j in range(DISTRICTS_PER_SIDE):
+                districts.append(
+                    (
+                        f"Quartier {c}-{i}-{j}",
+                        shapely.box(x + i * step, y + j * step, x + (i + 1) * step, y + (j + 1) * step),
+                    )
+                )
+    total = rng.integers(200, 8000, len(districts))
+    districts = {
+        "district_name": [name for name, _ in districts],
+        "geometry": [geometry for _, geometry in districts],
+        "total": total,
+        "z0_19": rng.uniform(10, 25, len(districts)).round(2),
+        "z20_64": rng.uniform(50, 70, len(districts)).round(2),
+        "u65": rng.uniform(10, 25, len(districts)).round(2),
+        "auslaender": rng.uniform(10, 40, len(districts)).round(2),
+        "diche_per_ha": (total / (step * step / 10**4)).round(2),
+    }
+
+    # stations uniformly inside every city
+    xs = np.concatenate([x + rng.uniform(0, CITY_SIZE, stations_per_city) for x, _ in origins])
+    ys = np.concatenate([y + rng.uniform(0, CITY_SIZE, stations_per_city) for _, y in origins])
+    station_ids = [f"nextbike_{i}" for i in range(len(xs))]
+    stations = _frame(
+        {"station_id": station_ids, "name": [f"Station {i}" for i in range(len(xs))]},
+        shapely.points(xs, ys),
+    )
+    stations["lon"] = stations.geometry.x
+    stations["lat"] = stations.geometry.y
+
+    district_frame = _frame(
+        {key: value for key, value in districts.items() if key != "geometry"},
+        districts["geometry"],
+    )
+    counts = gpd.sjoin(
+        stations[["geometry"]], district_frame[["district_name", "geometry"]], predicate="within"
+    )["district_name"].value_counts()
+    district_frame.insert(
+        1, "station_count", district_frame["district_name"].map(counts).fillna(0).astype(int)
+    )
+
+    # one river crossing and one lake at the edge of every city
+    rivers, lakes = [], []
+    for c, (x, y) in enumerate(origins):
+        t = np.linspace(0, 1, 200)
+        river_x = x - 1000 + t * (CITY_SIZE + 2000)
+        river_y = y + CITY_SIZE / 2 + 800 * np.sin(t * 6 * np.pi)
+        rivers.append((f"Fluss {c}", shapely.linestrings(river_x, river_y)))
+        lakes.append((f"See {c}", shapely.Point(x, y + CITY_SIZE).buffer(1500, quad_segs=32)))
+    lakes_and_rivers = _frame(
+        {
+            "type": ["river"] * len(rivers) + ["lake"] * len(lakes),
+            "GROSSERFLU": [name for name, _ in rivers + lakes],
+        },
+        [geometry for _, geometry in rivers + lakes],
+    )
+
+    # one row per station and hour of the day
+    hours = np.tile(np.arange(24), len(stations))
+    stations_and_bikes = gpd.GeoDataFrame(
+        {
+            "station_id": np.repeat(station_ids, 24),
+            "name": np.repeat(stations["name"].to_numpy(), 24),
+            "hour_of_day": hours,
+            "avg_num_bikes_available": rng.uniform(0, 6, len(hours)).round(2),
+        },
+        geometry=np.repeat(stations.geometry.to_numpy(), 24),
+        crs=EPSG_GLOBAL,
+    )
+
+    return {
+        "unique_stations": stations[["station_id", "name", "lat", "lon", "geometry"]],
+        "city_boundary": city_boundary,
+        "districts_and_stations": district_frame,
+        "lakes_and_rivers": lakes_and_rivers,
+        "stations_and_bikes": stations_and_bikes,
+        "canton_boundary": canton_boundary,
+    }
+
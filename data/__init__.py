@@ -8,9 +8,14 @@ from data.sharedmobility import (
     bigquery_stations_and_bikes,
     bigquery_canton_boundary
 )
+from data.batch import load_batch, BatchResult, BatchLoadError
+from data.tracing import span
+from data.materialize import refresh_stations_and_bikes
 
 
-def sharedmobility(type="unique_stations", inside_city=False, custom_sql=None):
+def sharedmobility(
+    type="unique_stations", inside_city=False, custom_sql=None, start=None, end=None
+):
     """
     Shared mobility data for the region of Luzern.
 
@@ -21,22 +26,51 @@ def sharedmobility(type="unique_stations", inside_city=False, custom_sql=None):
     type (str): The type of shared mobility data to retrieve. Options are:
         - unique_stations
         - unique_bikes
+        - stations_and_bikes_incremental: stations_and_bikes maintained
+          incrementally from the new crawls only
+    start (str, date or datetime): Only for unique_stations and
+        districts_and_stations, the crawls from this day or time are used
+        instead of the precomputed view.
+    end (str, date or datetime): End of the window (exclusive), one day after
+        `start` if not given.
     """
-    if custom_sql:
-        return query_bigquery_return_df(custom_sql)
-    if type == "unique_stations":
-        return bigquery_unique_stations(inside_city=inside_city)
-    elif type == "unique_bikes":
-        return bigquery_unique_bikes()
-    elif type == "city_boundary":
-        return bigquery_city_boundary()
-    elif type == "districts_and_stations":
-        return bigquery_districts_and_stations()
-    elif type == "lakes_and_rivers":
-        return bigquery_lakes_and_rivers()
-    elif type == 'stations_and_bikes':
-        return bigquery_stations_and_bikes()
-    elif type == 'canton_boundary':
-        return bigquery_canton_boundary()
-    else:
-        raise ValueError("Invalid type. Please choose the available types.")
+    with span("sharedmobility", type="custom_sql" if custom_sql else type):
+        if custom_sql:
+            return query_bigquery_return_df(custom_sql)
+        if type == "unique_stations":
+            return bigquery_unique_stations(inside_city=inside_city, start=start, end=end)
+        elif type == "unique_bikes":
+            return bigquery_unique_bikes()
+        elif type == "city_boundary":
+            return bigquery_city_boundary()
+        elif type == "districts_and_stations":
+            return bigquery_districts_and_stations(start=start, end=end)
+        elif type == "lakes_and_rivers":
+            return bigquery_lakes_and_rivers()
+        elif type == 'stations_and_bikes':
+            return bigquery_stations_and_bikes()
+        elif type == 'canton_boundary':
+            return bigquery_canton_boundary()
+        elif type == 'stations_and_bikes_incremental':
+            return refresh_stations_and_bikes()
+        else:
+            raise ValueError("Invalid type. Please choose the available types.")
+
+
+def sharedmobility_batch(types, timeout=None):
+    """
+    Loads several shared mobility datasets concurrently.
+
+    Returns:
+    BatchResult: `results` holds the data per type, `errors` the exception of
+        every type that failed or timed out.
+
+    Args:
+    types (list or dict): The types to load (see `sharedmobility`), or a dict
+        type -> keyword arguments for `sharedmobility`.
+    timeout (float or dict): Seconds to wait per query, see `load_batch`.
+    """
+    if not isinstance(types, dict):
+        types = {name: {} for name in types}
+    requests = {name: {"type": name, **kwargs} for name, kwargs in types.items()}
+    return load_batch(sharedmobility, requests, timeout=timeout)
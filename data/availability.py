@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+HOURS = 24
+
+
+class AvailabilityCube:
+    """
+    Average number of available bikes per district and hour of the day.
+
+    The stations are assigned to the districts with one spatial index query
+    and the averages are summed into dense (districts x 24) arrays, so a
+    single hour or the daily profile is an array slice.
+
+    Args:
+    districts (GeoDataFrame): The district polygons.
+    stations_and_bikes (GeoDataFrame): One row per station and hour with the
+        columns `hour_of_day` and `avg_num_bikes_available`, in the same CRS
+        as `districts`.
+    district_column (str): Column with the district names.
+    """
+
+    def __init__(self, districts, stations_and_bikes, district_column="district_name"):
+        if stations_and_bikes.crs != districts.crs:
+            stations_and_bikes = stations_and_bikes.to_crs(crs=districts.crs)
+        self.district_column = district_column
+        self.districts = districts[[district_column, districts.geometry.name]]
+
+        # station rows within each district, like sjoin(predicate="contains")
+        rows, district_positions = districts.sindex.query(
+            stations_and_bikes.geometry.values, predicate="within"
+        )
+        hours = stations_and_bikes["hour_of_day"].to_numpy()[rows].astype(np.intp)
+        values = np.nan_to_num(
+            stations_and_bikes["avg_num_bikes_available"].to_numpy(dtype=float)[rows]
+        )
+
+        self.sums = np.zeros((len(districts), HOURS))
+        self.counts = np.zeros((len(districts), HOURS), dtype=np.int64)
+        np.add.at(self.sums, (district_positions, hours), values)
+        np.add.at(self.counts, (district_positions, hours), 1)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.means = np.where(self.counts > 0, self.sums / self.counts, 0.0)
+
+        # districts without any station count as one row with no bikes
+        self._rows = self.counts.sum(axis=0) + (self.counts.sum(axis=1) == 0).sum()
+
+    def hour(self, hour):
+        """
+        Average available bikes per district at `hour`, 0 without stations.
+        """
+        return self.means[:, hour]
+
+    def hour_frame(self, hour, districts=None):
+        """
+        Returns the districts with the column `avg_num_bikes_available` for
+        `hour`. `districts` can be the same districts in another CRS.
+        """
+        districts = self.districts if districts is None else districts
+        return districts[[self.district_column, districts.geometry.name]].assign(
+            hour_of_day=hour,
+            avg_num_bikes_available=np.round(self.hour(hour), 2),
+        )
+
+    def overall(self, hour=None):
+        """
+        Average over all station rows of one hour, or of every hour if `hour`
+        is None, with districts without stations counted as 0.
+        """
+        totals = self.sums.sum(axis=0) / np.maximum(self._rows, 1)
+        return totals if hour is None else totals[hour]
+
+    def hourly(self):
+        """
+        The daily profile as DataFrame with the columns `hour_of_day` and
+        `avg_num_bikes_available`.
+        """
+        return pd.DataFrame(
+            {"hour_of_day": np.arange(HOURS), "avg_num_bikes_available": self.overall()}
+        )
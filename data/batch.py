@@ -0,0 +1,109 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# upper bound for the threads used by one batch, one per dataset load_data() fires
+BATCH_MAX_WORKERS = 6
+
+
+class BatchLoadError(Exception):
+    """
+    Raised by `BatchResult.raise_for_errors()` when at least one query failed.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        details = ", ".join(f"{name}: {error!r}" for name, error in errors.items())
+        super().__init__(f"{len(errors)} dataset(s) could not be loaded ({details})")
+
+
+class BatchResult:
+    """
+    Outcome of a batch load.
+
+    Attributes:
+    results (dict): Dataset name -> loaded data for every query that succeeded.
+    errors (dict): Dataset name -> exception for every query that failed or
+        timed out (`TimeoutError`).
+    durations (dict): Dataset name -> seconds until the query finished.
+    """
+
+    def __init__(self):
+        self.results = {}
+        self.errors = {}
+        self.durations = {}
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def __getitem__(self, name):
+        return self.results[name]
+
+    def raise_for_errors(self):
+        if self.errors:
+            raise BatchLoadError(self.errors)
+        return self
+
+
+def _timed(loader, kwargs):
+    start = time.perf_counter()
+    data = loader(**kwargs)
+    return data, time.perf_counter() - start
+
+
+def load_batch(loader, requests, timeout=None, max_workers=BATCH_MAX_WORKERS):
+    """
+    Runs several dataset loads concurrently and gathers their results.
+
+    All queries are submitted at once, so the batch takes about as long as the
+    slowest query instead of the sum of all of them. A failing or timed out
+    query does not cancel the others, it is reported in `BatchResult.errors`.
+
+    Args:
+    loader (callable): Called with the keyword arguments of each request,
+        e.g. `data.sharedmobility`.
+    requests (dict): Dataset name -> keyword arguments for `loader`.
+    timeout (float or dict): Seconds to wait for each query, either one value
+        for all or a dict with one value per dataset name. None waits forever.
+    max_workers (int): Maximum number of queries running at the same time.
+
+    Returns:
+    BatchResult: The loaded datasets and the errors of the failed ones.
+    """
+    batch = BatchResult()
+    if not requests:
+        return batch
+
+    workers = max(1, min(max_workers, len(requests)))
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="load")
+    try:
+        submitted = time.monotonic()
+        futures = {
+            # each query runs in a copy of the caller's context, e.g. its trace
+            name: executor.submit(contextvars.copy_context().run, _timed, loader, kwargs)
+            for name, kwargs in requests.items()
+        }
+
+        for name, future in futures.items():
+            limit = timeout.get(name) if isinstance(timeout, dict) else timeout
+            remaining = None
+            if limit is not None:
+                remaining = max(0.0, submitted + limit - time.monotonic())
+            try:
+                data, duration = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                future.cancel()
+                batch.errors[name] = TimeoutError(
+                    f"Loading {name} took longer than {limit} seconds."
+                )
+            except Exception as error:
+                batch.errors[name] = error
+            else:
+                batch.results[name] = data
+                batch.durations[name] = duration
+    finally:
+        # do not block on queries that timed out, they finish in the background
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return batch
@@ -0,0 +1,210 @@
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+import geopandas as gpd
+import pandas as pd
+import pyarrow.parquet as pq
+from contextlib import contextmanager
+from data.costs import BUDGET_MODE, QueryBudgetExceeded, costs
+from data.tracing import span
+
+# directory of the on-disk cache, an empty value disables it
+CACHE_DIR = os.environ.get("SHAREDMOBILITY_CACHE_DIR", "data/cache")
+
+# seconds a cached result stays valid
+CACHE_TTL = float(os.environ.get("SHAREDMOBILITY_CACHE_TTL", 24 * 60 * 60))
+
+# the oldest entries are removed once the cache grows beyond this many bytes
+CACHE_MAX_BYTES = int(os.environ.get("SHAREDMOBILITY_CACHE_MAX_BYTES", 512 * 1024**2))
+
+CACHE_SUFFIX = ".parquet"
+
+_max_age = contextvars.ContextVar("max_age", default=None)
+
+
+def cache_key(query_type, query, namespace="", params=None):
+    # every parameter set of the same query is cached on its own
+    params = json.dumps(params or {}, sort_keys=True, default=str)
+    digest = hashlib.sha256(f"{namespace}\n{query}\n{params}".encode("utf-8"))
+    return f"{query_type}-{digest.hexdigest()[:16]}"
+
+
+class ParquetCache:
+    """
+    Persistent cache of query results stored as (Geo)Parquet files.
+
+    GeoDataFrames are written as GeoParquet with WKB geometries, plain
+    DataFrames as Parquet. Entries are keyed by query type and SQL hash,
+    expire after `ttl` seconds and the least recently used entries are evicted
+    once the directory grows beyond `max_bytes`. Reads memory-map the file.
+
+    Args:
+    directory (str): Where the cache files are stored.
+    ttl (float): Seconds a cached entry stays valid.
+    max_bytes (int): Size limit of all cached entries together.
+    """
+
+    def __init__(self, directory=CACHE_DIR, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def path(self, query_type, query, namespace="", params=None):
+        key = cache_key(query_type, query, namespace, params)
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def get(self, query_type, query, namespace="", params=None, ttl=None):
+        """
+        Returns the cached result or None if there is no valid entry.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        path = self.path(query_type, query, namespace, params)
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except OSError:
+            return None
+        if age > ttl:
+            return None
+
+        try:
+            # the geo metadata tells if the entry was a GeoDataFrame
+            metadata = pq.read_schema(path, memory_map=True).metadata or {}
+            if b"geo" in metadata:
+                data = gpd.read_parquet(path, memory_map=True)
+            else:
+                data = pd.read_parquet(path, engine="pyarrow", memory_map=True)
+        except Exception:
+            # a corrupt entry is treated like a miss and rewritten on the next put
+            return None
+
+        # mark the entry as recently used for eviction
+        try:
+            os.utime(path, times=(time.time(), os.path.getmtime(path)))
+        except OSError:
+            pass
+        return data
+
+    def put(self, query_type, query, data, namespace="", params=None):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(query_type, query, namespace, params)
+        # write to a temporary file first, so readers never see a partial file
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            if isinstance(data, gpd.GeoDataFrame):
+                data.to_parquet(tmp_path, index=False)
+            else:
+                data.to_parquet(tmp_path, engine="pyarrow", index=False)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if not name.endswith(CACHE_SUFFIX):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, name))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                total -= size
+
+    def clear(self):
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(CACHE_SUFFIX):
+                os.remove(os.path.join(self.directory, name))
+
+
+_cache = None
+
+
+def get_cache():
+    """
+    Returns the process-wide cache or None if caching is disabled.
+    """
+    global _cache
+    if _cache is None and CACHE_DIR:
+        _cache = ParquetCache()
+    return _cache
+
+
+def set_cache(cache):
+    global _cache
+    _cache = cache
+
+
+@contextmanager
+def max_cache_age(seconds):
+    """
+    Within the block, cached results older than `seconds` are treated as
+    missing, e.g. while the shared datasets are reloaded.
+    """
+    token = _max_age.set(seconds)
+    try:
+        yield
+    finally:
+        _max_age.reset(token)
+
+
+def cached_query(query_type, query, run_query, namespace="", params=None):
+    """
+    Returns the cached result of `query` with `params` or runs it with
+    `run_query(query, params)` and stores the result. Results without a
+    `query_type` are never cached. `namespace` separates the results of
+    different backends. See `max_cache_age` to read only fresher results.
+
+    A query refused by the byte budget is answered with the last cached
+    result regardless of its age if `BUDGET_MODE` is "stale".
+    """
+    with span("query", query_type=query_type, backend=namespace) as current:
+        cache = get_cache() if query_type else None
+        if cache is None:
+            data = run_query(query, params)
+            current.set(cache="off", rows=len(data))
+            return data
+
+        max_age = _max_age.get()
+        ttl = None if max_age is None else min(max_age, cache.ttl)
+        data = cache.get(query_type, query, namespace, params, ttl=ttl)
+        if data is not None:
+            current.set(cache="hit", rows=len(data))
+            return data
+
+        try:
+            data = run_query(query, params)
+        except QueryBudgetExceeded:
+            if BUDGET_MODE != "stale":
+                raise
+            data = cache.get(query_type, query, namespace, params, ttl=float("inf"))
+            if data is None:
+                raise
+            costs.record_stale(query_type)
+            current.set(cache="stale", rows=len(data))
+            return data
+        current.set(cache="miss", rows=len(data))
+        try:
+            cache.put(query_type, query, data, namespace, params)
+        except Exception:
+            # a full or read-only disk must not break the query
+            pass
+        return data
@@ -0,0 +1,130 @@
+import os
+import threading
+from data.tracing import current_span
+
+# bytes a single BigQuery query may scan by the dry-run estimate, 0 for no limit
+MAX_BYTES_PER_QUERY = int(os.environ.get("SHAREDMOBILITY_MAX_BYTES_PER_QUERY", 0))
+
+# what happens to a query over the budget: "stale" serves the last cached
+# result regardless of its age and refuses only if there is none, "refuse"
+# always refuses
+BUDGET_MODE = os.environ.get("SHAREDMOBILITY_BUDGET_MODE", "stale")
+
+# estimate the bytes of every query with a dry run before it runs, always on
+# with a budget. the processed bytes are recorded from the finished job anyway
+DRY_RUN = os.environ.get("SHAREDMOBILITY_DRY_RUN", "") not in ("", "0", "false")
+
+COST_FIELDS = [
+    "queries",
+    "estimated_bytes",
+    "bytes_processed",
+    "bytes_billed",
+    "slot_millis",
+    "cache_hits",
+    "refused",
+    "stale",
+]
+
+
+class QueryBudgetExceeded(Exception):
+    """
+    Raised instead of running a query whose dry run scans more than the budget.
+    """
+
+    def __init__(self, query_type, estimated_bytes, budget):
+        self.query_type = query_type
+        self.estimated_bytes = estimated_bytes
+        self.budget = budget
+        super().__init__(
+            f"Query {query_type or '<untyped>'} would scan {estimated_bytes} bytes, "
+            f"the budget is {budget} bytes."
+        )
+
+
+class QueryCosts:
+    """
+    Process-wide totals of what the BigQuery queries scanned, per query type.
+
+    Every counter of `COST_FIELDS` is summed per query type, queries
+    without a type are counted as "<untyped>". The numbers of a query are
+    also set on the current span, so they show up in the trace.
+    """
+
+    def __init__(self):
+        self._costs = {}
+        self._lock = threading.Lock()
+
+    def _add(self, query_type, **counts):
+        with self._lock:
+            costs = self._costs.setdefault(
+                query_type or "<untyped>", dict.fromkeys(COST_FIELDS, 0)
+            )
+            for name, value in counts.items():
+                costs[name] += value or 0
+
+    def record_estimate(self, query_type, estimated_bytes):
+        self._add(query_type, estimated_bytes=estimated_bytes)
+        self._set_span(estimated_bytes=estimated_bytes)
+
+    def record_job(self, query_type, job):
+        """
+        Records the statistics of a finished `google.cloud.bigquery.QueryJob`.
+        """
+        stats = {
+            "bytes_processed": job.total_bytes_processed or 0,
+            "bytes_billed": job.total_bytes_billed or 0,
+            "slot_millis": job.slot_millis or 0,
+        }
+        self._add(query_type, queries=1, cache_hits=int(bool(job.cache_hit)), **stats)
+        self._set_span(bq_cache_hit=bool(job.cache_hit), **stats)
+
+    def record_refused(self, query_type):
+        self._add(query_type, refused=1)
+
+    def record_stale(self, query_type):
+        self._add(query_type, stale=1)
+
+    def _set_span(self, **attributes):
+        current = current_span()
+        if current is not None:
+            current.set(**attributes)
+
+    def snapshot(self):
+        with self._lock:
+            return {query_type: dict(costs) for query_type, costs in self._costs.items()}
+
+    def to_records(self):
+        return [
+            {"query_type": query_type, **costs}
+            for query_type, costs in sorted(self.snapshot().items())
+        ]
+
+    def openmetrics(self):
+        """
+        Returns the totals as OpenMetrics counters, without the "# EOF" line.
+        """
+        lines = []
+        snapshot = self.snapshot()
+        for field in COST_FIELDS:
+            name = f"sharedmobility_bigquery_{field}"
+            lines += [
+                f"# TYPE {name} counter",
+                f"# HELP {name} BigQuery {field.replace('_', ' ')} per query type.",
+            ]
+            for query_type, costs in sorted(snapshot.items()):
+                lines.append(f'{name}_total{{query_type="{query_type}"}} {costs[field]}')
+        return "\n".join(lines) + "\n"
+
+
+costs = QueryCosts()
+
+
+def check_budget(query_type, estimated_bytes, budget=None):
+    """
+    Raises `QueryBudgetExceeded` if the estimate is over the budget,
+    `MAX_BYTES_PER_QUERY` by default.
+    """
+    budget = MAX_BYTES_PER_QUERY if budget is None else budget
+    if budget and estimated_bytes > budget:
+        costs.record_refused(query_type)
+        raise QueryBudgetExceeded(query_type, estimated_bytes, budget)
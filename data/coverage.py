@@ -0,0 +1,77 @@
+import threading
+import geopandas as gpd
+import shapely
+from data.crs import EPSG_SWISS, EPSG_GLOBAL
+
+# radii offered by the "Station-Umkreis" slider, in meters
+COVERAGE_RADII = range(100, 501, 100)
+
+# tolerance in meters of the simplified polygon sent to the map
+COVERAGE_SIMPLIFY_TOLERANCE = 5
+
+
+class Coverage:
+    """
+    Area within `radius` meters of any station, clipped to the boundary.
+
+    Attributes:
+    radius (float): The radius in meters.
+    geometry (Polygon or MultiPolygon): The full resolution coverage in the
+        swiss CRS.
+    area (float): The area of `geometry` in square meters.
+    geojson (dict): The simplified coverage in WGS84, ready for folium.
+    """
+
+    def __init__(self, radius, geometry, simplify_tolerance):
+        self.radius = radius
+        self.geometry = geometry
+        self.area = geometry.area
+        display = shapely.simplify(geometry, simplify_tolerance, preserve_topology=True)
+        self.geojson = (
+            gpd.GeoSeries([display], crs=EPSG_SWISS).to_crs(crs=EPSG_GLOBAL).__geo_interface__
+        )
+
+
+class CoverageIndex:
+    """
+    Memoized station coverage per radius.
+
+    Buffering every station, clipping and dissolving the buffers is done once
+    per radius, later requests for the same radius return the stored result.
+
+    Args:
+    stations (GeoDataFrame): Station points in the swiss CRS.
+    boundary (Polygon): The area the coverage is clipped to, e.g. the city.
+    simplify_tolerance (float): Tolerance in meters of the displayed polygon.
+    """
+
+    def __init__(self, stations, boundary, simplify_tolerance=COVERAGE_SIMPLIFY_TOLERANCE):
+        if stations.crs is not None and stations.crs != EPSG_SWISS:
+            stations = stations.to_crs(crs=EPSG_SWISS)
+        self._points = stations.geometry.to_numpy()
+        self.boundary = boundary
+        self.simplify_tolerance = simplify_tolerance
+        self._coverages = {}
+        self._lock = threading.Lock()
+
+    def _build(self, radius):
+        buffers = shapely.buffer(self._points, radius)
+        # dissolve first and clip once, instead of clipping every buffer
+        union = shapely.union_all(buffers)
+        return Coverage(
+            radius, shapely.intersection(union, self.boundary), self.simplify_tolerance
+        )
+
+    def get(self, radius):
+        coverage = self._coverages.get(radius)
+        if coverage is None:
+            with self._lock:
+                coverage = self._coverages.get(radius)
+                if coverage is None:
+                    coverage = self._coverages[radius] = self._build(radius)
+        return coverage
+
+    def precompute(self, radii=COVERAGE_RADII):
+        for radius in radii:
+            self.get(radius)
+        return self
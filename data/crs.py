@@ -0,0 +1,13 @@
+EPSG_GLOBAL = "EPSG:4326"
+# EPSG_SWISS = "EPSG:21781" #old swiss crs
+EPSG_SWISS = "EPSG:2056"  # new swiss crs
+
+
+# convert to swiss crs
+def convert_to_swiss_crs(gdf):
+    return gdf.to_crs(crs=EPSG_SWISS)
+
+
+# convert to global crs
+def convert_to_global_crs(gdf):
+    return gdf.to_crs(crs=EPSG_GLOBAL)
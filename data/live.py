@@ -0,0 +1,217 @@
+import glob
+import os
+import threading
+import pandas as pd
+from data.sharedmobility import bigquery_unique_bikes
+
+# seconds between two polls of the free bike snapshot
+LIVE_POLL_INTERVAL = float(os.environ.get("SHAREDMOBILITY_LIVE_POLL_INTERVAL", 60))
+
+# directory of recorded snapshots replayed instead of querying the backend
+LIVE_REPLAY_DIR = os.environ.get("SHAREDMOBILITY_LIVE_REPLAY_DIR", "")
+
+BIKE_KEY = "bike_id"
+BIKE_POSITION = ["lat", "lon"]
+
+
+class BikeDelta:
+    """
+    Changes between two free bike snapshots.
+
+    Attributes:
+    added (DataFrame): Bikes only in the new snapshot.
+    moved (DataFrame): Bikes in both snapshots whose position changed, with
+        the new position.
+    removed (Index): Ids of the bikes only in the old snapshot.
+    """
+
+    def __init__(self, added, moved, removed):
+        self.added = added
+        self.moved = moved
+        self.removed = removed
+
+    def __len__(self):
+        return len(self.added) + len(self.moved) + len(self.removed)
+
+
+def index_bikes(snapshot, key=BIKE_KEY):
+    return snapshot.drop_duplicates(key, keep="last").set_index(key)
+
+
+def diff_snapshots(previous, current, position=BIKE_POSITION):
+    """
+    Compares two snapshots indexed by bike id, see `index_bikes`.
+
+    Returns:
+    BikeDelta: The added, moved and removed bikes.
+    """
+    removed = previous.index.difference(current.index)
+    added = current[~current.index.isin(previous.index)]
+
+    common = current.index.intersection(previous.index)
+    old = previous.loc[common, position].to_numpy(dtype=float)
+    new = current.loc[common, position].to_numpy(dtype=float)
+    moved = current.loc[common[(old != new).any(axis=1)]]
+    return BikeDelta(added, moved, removed)
+
+
+class ReplayFeed:
+    """
+    Replays recorded free bike snapshots instead of querying the backend, one
+    snapshot per call, e.g. to test the live layer offline. The last snapshot
+    is repeated once the recording is exhausted.
+
+    Args:
+    snapshots (list or str): DataFrames, or a directory with one `.parquet`
+        or `.csv` file per snapshot in crawl order.
+    """
+
+    def __init__(self, snapshots):
+        if isinstance(snapshots, str):
+            paths = sorted(
+                glob.glob(os.path.join(snapshots, "*.parquet"))
+                + glob.glob(os.path.join(snapshots, "*.csv"))
+            )
+            snapshots = [
+                pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path)
+                for path in paths
+            ]
+        if not snapshots:
+            raise ValueError("The replay feed needs at least one snapshot.")
+        self.snapshots = list(snapshots)
+        self.position = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            snapshot = self.snapshots[self.position]
+            self.position = min(self.position + 1, len(self.snapshots) - 1)
+        return snapshot
+
+
+def live_feed():
+    """
+    Returns the snapshot source of the live layer, a `ReplayFeed` of
+    `LIVE_REPLAY_DIR` if set, otherwise the newest BigQuery snapshot.
+    """
+    if LIVE_REPLAY_DIR:
+        return ReplayFeed(LIVE_REPLAY_DIR)
+    return bigquery_unique_bikes
+
+
+class LiveBikes:
+    """
+    The current free bike positions, maintained from periodic snapshots.
+
+    Every poll diffs the new snapshot against the current one by bike id and
+    only the added, moved and removed bikes touch the GeoJSON features kept
+    per bike, so a refresh costs in proportion to what changed. A background
+    thread polls every `interval` seconds, sessions read the shared state.
+
+    The delta is only used on the server. streamlit-folium replaces the whole
+    feature group in the browser, so every session still receives all bikes
+    when the layer is drawn.
+
+    A failed fetch keeps the last snapshot, no bikes before the first one,
+    and is kept in `error` until a fetch succeeds again.
+
+    Args:
+    fetch (callable): Returns the newest snapshot as DataFrame, e.g.
+        `bigquery_unique_bikes` or a `ReplayFeed`.
+    interval (float): Seconds between the polls of the background thread.
+    """
+
+    def __init__(self, fetch=bigquery_unique_bikes, interval=LIVE_POLL_INTERVAL):
+        self.fetch = fetch
+        self.interval = interval
+        self.version = 0
+        self.bikes = None
+        self.error = None
+        self.features = {}
+        self._geojson = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _update_features(self, delta):
+        for bike_id in delta.removed:
+            self.features.pop(bike_id, None)
+        for frame in (delta.added, delta.moved):
+            for bike_id, lat, lon in zip(
+                frame.index, frame["lat"].to_numpy(float), frame["lon"].to_numpy(float)
+            ):
+                self.features[bike_id] = {
+                    "type": "Feature",
+                    "id": str(bike_id),
+                    "properties": {BIKE_KEY: str(bike_id)},
+                    "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                }
+        self._geojson = None
+
+    def poll(self):
+        """
+        Fetches a snapshot and applies its delta.
+
+        Returns:
+        BikeDelta: The changes, None if nothing changed or the fetch failed.
+        """
+        try:
+            current = index_bikes(self.fetch())
+        except Exception as e:
+            self.error = e
+            return None
+        with self._lock:
+            self.error = None
+            previous = self.bikes if self.bikes is not None else current.iloc[:0]
+            delta = diff_snapshots(previous, current)
+            if self.bikes is not None and not len(delta):
+                return None
+            self._update_features(delta)
+            self.bikes = current
+            self.version += 1
+            return delta
+
+    def snapshot(self):
+        """
+        Returns the version and the bikes indexed by bike id, the version
+        changes with every applied delta.
+        """
+        if self.bikes is None:
+            self.poll()
+        with self._lock:
+            if self.bikes is None:
+                return self.version, pd.DataFrame(columns=BIKE_POSITION).rename_axis(BIKE_KEY)
+            return self.version, self.bikes
+
+    def geojson(self):
+        """
+        The current bikes as GeoJSON FeatureCollection, rebuilt from the
+        per-bike features only after a change.
+        """
+        if self.bikes is None:
+            self.poll()
+        with self._lock:
+            if self._geojson is None:
+                self._geojson = {
+                    "type": "FeatureCollection",
+                    "features": list(self.features.values()),
+                }
+            return self._geojson
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                # a failed poll keeps the last snapshot, the next one retries
+                pass
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="live-bikes", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,271 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+import geopandas as gpd
+import pandas as pd
+from data.cache import CACHE_DIR
+from data.crs import EPSG_GLOBAL
+from data.sharedmobility import get_backend, bigquery_city_boundary
+
+# where the running sums and the watermarks are kept between restarts
+MATERIALIZE_DIR = os.environ.get(
+    "SHAREDMOBILITY_MATERIALIZE_DIR",
+    os.path.join(CACHE_DIR or "data/cache", "materialized"),
+)
+
+# crawls younger than this are left for the next refresh, they may still be loading
+MATERIALIZE_LAG = timedelta(minutes=15)
+
+# the station_status crawls averaged, by default the same year as the
+# `stations_and_bikes` view. an empty end averages all crawls up to now
+MATERIALIZE_START = datetime.fromisoformat(
+    os.environ.get("SHAREDMOBILITY_MATERIALIZE_START", "2023-01-01")
+)
+MATERIALIZE_END = os.environ.get("SHAREDMOBILITY_MATERIALIZE_END", "2024-01-01")
+MATERIALIZE_END = datetime.fromisoformat(MATERIALIZE_END) if MATERIALIZE_END else None
+
+# watermark of a new aggregate, the stations are read from all crawls
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+SQL_STATION_STATUS_DELTA = """
+SELECT
+  station_id,
+  EXTRACT(HOUR FROM crawl_time) AS hour_of_day,
+  SUM(num_bikes_available) AS sum_bikes,
+  COUNT(num_bikes_available) AS count_bikes
+FROM `seli-data-storage.data_storage_1.station_status`
+WHERE crawl_time > @since
+  AND crawl_time <= @until
+  AND crawl_time >= @start
+  AND crawl_time < @end
+  AND provider_id LIKE '%nextbike%'
+GROUP BY station_id, hour_of_day
+"""
+
+SQL_STATION_INFORMATION_DELTA = """
+SELECT
+  station_id,
+  name,
+  lat,
+  lon,
+  crawl_time AS first_crawl_time
+FROM `seli-data-storage.data_storage_1.station_information`
+WHERE crawl_time > @since
+  AND crawl_time <= @until
+QUALIFY ROW_NUMBER() OVER (PARTITION BY station_id ORDER BY crawl_time) = 1
+"""
+
+
+def as_utc(value):
+    # naive datetimes are taken as UTC
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def append_frame(frame, new):
+    # concatenating onto an empty frame is deprecated by pandas
+    if frame.empty:
+        return new
+    if new.empty:
+        return frame
+    return pd.concat([frame, new], ignore_index=True)
+
+
+class StationsAndBikesAggregate:
+    """
+    Incrementally maintained version of the `stations_and_bikes` view.
+
+    Instead of averaging a whole year of `station_status` on every refresh,
+    the aggregate keeps per station and hour the running sum and count of the
+    available bikes and the first name and position of every station. A
+    refresh only reads the crawls between the last watermark and now, which
+    BigQuery prunes to the new `crawl_time` partitions.
+
+    Like the view, the bikes are averaged over the crawls from `start` to
+    `end` only, while the stations are taken from all crawls. Without `end`
+    the average rolls forward with every refresh. A persisted state of
+    another window is discarded and rebuilt.
+
+    Args:
+    directory (str): Where the state is persisted, None keeps it in memory.
+    start (datetime): First crawl_time of the averaged station_status.
+    end (datetime): End (exclusive) of the averaged station_status, None
+        for all crawls up to the refresh.
+    """
+
+    def __init__(self, directory=MATERIALIZE_DIR, start=MATERIALIZE_START, end=MATERIALIZE_END):
+        self.directory = directory
+        self.start = as_utc(start)
+        self.end = as_utc(end) if end is not None else None
+        self.watermark = EPOCH
+        self.status = pd.DataFrame(
+            {
+                "station_id": pd.Series(dtype=object),
+                "hour_of_day": pd.Series(dtype="int64"),
+                "sum_bikes": pd.Series(dtype=float),
+                "count_bikes": pd.Series(dtype="int64"),
+            }
+        )
+        self.stations = pd.DataFrame(
+            {
+                "station_id": pd.Series(dtype=object),
+                "name": pd.Series(dtype=object),
+                "lat": pd.Series(dtype=float),
+                "lon": pd.Series(dtype=float),
+                "first_crawl_time": pd.Series(dtype="datetime64[ns]"),
+            }
+        )
+        self._lock = threading.Lock()
+        if directory:
+            self.load()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def load(self):
+        try:
+            with open(self._path("state.json")) as f:
+                state = json.load(f)
+            status = pd.read_parquet(self._path("status.parquet"))
+            stations = pd.read_parquet(self._path("stations.parquet"))
+        except (OSError, ValueError):
+            return False
+        if state.get("window") != self._window():
+            return False
+        self.watermark = datetime.strptime(state["watermark"], TIMESTAMP_FORMAT).replace(
+            tzinfo=timezone.utc
+        )
+        self.status = status
+        self.stations = stations
+        return True
+
+    def _window(self):
+        return [
+            self.start.strftime(TIMESTAMP_FORMAT),
+            self.end.strftime(TIMESTAMP_FORMAT) if self.end else None,
+        ]
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.status.to_parquet(self._path("status.parquet"), index=False)
+        self.stations.to_parquet(self._path("stations.parquet"), index=False)
+        # the watermark is written last, a crash before leaves the old one
+        with open(self._path("state.json.tmp"), "w") as f:
+            json.dump(
+                {
+                    "watermark": self.watermark.strftime(TIMESTAMP_FORMAT),
+                    "window": self._window(),
+                },
+                f,
+            )
+        os.replace(self._path("state.json.tmp"), self._path("state.json"))
+
+    def refresh(self, until=None, backend=None):
+        """
+        Adds the crawls after the watermark up to `until` (default now minus
+        `MATERIALIZE_LAG`, naive values are UTC) and moves the watermark.
+
+        Returns:
+        int: Number of (station, hour) groups that received new crawls.
+        """
+        backend = backend or get_backend()
+        with self._lock:
+            if until is None:
+                until = datetime.now(timezone.utc) - MATERIALIZE_LAG
+            until = as_utc(until).replace(microsecond=0)
+            if until <= self.watermark:
+                return 0
+            window = {"since": self.watermark, "until": until}
+            # without an end the crawls up to `until` are averaged
+            end = self.end or until + timedelta(seconds=1)
+
+            status = backend.query_df(
+                SQL_STATION_STATUS_DELTA,
+                params={**window, "start": self.start, "end": end},
+                query_type="station_status_delta",
+            )
+            stations = backend.query_df(
+                SQL_STATION_INFORMATION_DELTA,
+                params=window,
+                query_type="station_information_delta",
+            )
+
+            status = status.astype(
+                {"hour_of_day": "int64", "sum_bikes": float, "count_bikes": "int64"}
+            )
+            self.status = (
+                append_frame(self.status, status)
+                .groupby(["station_id", "hour_of_day"], as_index=False)[
+                    ["sum_bikes", "count_bikes"]
+                ]
+                .sum()
+            )
+
+            # the first name and position of a station never change once known
+            stations["first_crawl_time"] = pd.to_datetime(
+                stations["first_crawl_time"], utc=True
+            ).dt.tz_localize(None)
+            self.stations = (
+                append_frame(self.stations, stations)
+                .sort_values("first_crawl_time", kind="stable")
+                .drop_duplicates("station_id", keep="first")
+                .reset_index(drop=True)
+            )
+
+            self.watermark = until
+            if self.directory:
+                self.save()
+            return len(status)
+
+    def to_geodataframe(self, city_boundary):
+        """
+        Returns the aggregate with the columns of the `stations_and_bikes`
+        view, for the stations inside `city_boundary` (a WGS84 geometry).
+        """
+        # like the view, stations without a name are dropped as well
+        names = self.stations["name"]
+        stations = self.stations[
+            names.notna() & ~names.str.contains("Teststation", regex=False, na=False)
+        ]
+        stations = gpd.GeoDataFrame(
+            stations[["station_id", "name"]],
+            geometry=gpd.points_from_xy(stations["lon"], stations["lat"]),
+            crs=EPSG_GLOBAL,
+        )
+        stations = stations[stations.within(city_boundary)]
+
+        status = self.status[self.status["count_bikes"] > 0]
+        df = stations.merge(status, on="station_id", how="inner")
+        df["avg_num_bikes_available"] = (df["sum_bikes"] / df["count_bikes"]).round(2)
+        df = df.sort_values(["station_id", "hour_of_day"]).reset_index(drop=True)
+        return df[
+            ["station_id", "geometry", "name", "hour_of_day", "avg_num_bikes_available"]
+        ]
+
+
+_aggregate = None
+_aggregate_lock = threading.Lock()
+
+
+def get_stations_and_bikes_aggregate():
+    global _aggregate
+    if _aggregate is None:
+        with _aggregate_lock:
+            if _aggregate is None:
+                _aggregate = StationsAndBikesAggregate()
+    return _aggregate
+
+
+def refresh_stations_and_bikes():
+    """
+    Refreshes the process-wide aggregate with the new crawls and returns it
+    like `bigquery_stations_and_bikes`.
+    """
+    aggregate = get_stations_and_bikes_aggregate()
+    aggregate.refresh()
+    city_boundary = bigquery_city_boundary().to_crs(crs=EPSG_GLOBAL).geometry.iloc[0]
+    return aggregate.to_geodataframe(city_boundary)
@@ -1,73 +1,146 @@
-from datetime import datetime
-import os
-from google.cloud import bigquery
-
-
-def create_bigquery_connection():
-    service_account_key_path = "service_key.json"
-
-    if os.path.exists(service_account_key_path):
-        return bigquery.Client.from_service_account_json(
-            service_account_key_path, project="seli-data-storage"
-        )
-    else:
-        return bigquery.Client(project="seli-data-storage")
-
-
-def query_bigquery_return_df(query):
-    query_job = create_bigquery_connection().query(query)
-    results = query_job.result()
-
-    return results.to_dataframe()
-
-def query_bigquery_return_gdf(query):
-    query_job = create_bigquery_connection().query(query)
-    results = query_job.result()
-
-    return results.to_geodataframe()
-
-def bigquery_unique_stations(
-    timefilter=datetime.now().strftime("%Y-%m-%d"), inside_city=False
-):
-    
+import functools
+from datetime import datetime, time, timedelta, timezone
+from data.sharedmobility.client import (
+    BigQueryClientPool,
+    create_bigquery_connection,
+    get_bigquery_pool,
+    set_bigquery_pool,
+    close_bigquery_pool,
+)
+from data.sharedmobility.backends import (
+    Backend,
+    BigQueryBackend,
+    DuckDBBackend,
+    STREAM_BATCH_SIZE,
+    get_backend,
+    set_backend,
+)
+from data.sharedmobility.geometry import points_from_lonlat
+from data.sharedmobility.snapshot import LatestSnapshot, free_bike_status
+from data.cache import cached_query
+
+
+def query_bigquery_return_df(query, query_type=None, params=None):
+    backend = get_backend()
+    return cached_query(
+        query_type,
+        query,
+        functools.partial(backend.query_df, query_type=query_type),
+        namespace=backend.name,
+        params=params,
+    )
+
+def query_bigquery_return_gdf(query, query_type=None, params=None):
+    backend = get_backend()
+    return cached_query(
+        query_type,
+        query,
+        functools.partial(backend.query_gdf, query_type=query_type),
+        namespace=backend.name,
+        params=params,
+    )
+
+def query_bigquery_iter_frames(query, params=None, geometry=None, query_type=None):
+    """
+    Streams the result of `query` in chunks of `STREAM_BATCH_SIZE` rows,
+    read as Arrow record batches through the BigQuery Storage Read API.
+    Chunks with geometry columns are GeoDataFrames. Results are not cached.
+    """
+    return get_backend().iter_frames(
+        query, params=params, geometry=geometry, query_type=query_type
+    )
+
+def _as_utc_datetime(value):
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, time())
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+def time_window(timefilter=None, start=None, end=None):
+    """
+    Returns the query parameters `start` and `end` (exclusive) as UTC
+    timestamps, or None if no time filter is given.
+
+    Args:
+    timefilter (str or date): A single day, e.g. "2024-05-01".
+    start (str, date or datetime): Start of the window.
+    end (str, date or datetime): End of the window, one day after `start` if
+        not given.
+    """
+    if timefilter is not None:
+        start = timefilter
+    if start is None:
+        return None
+    start = _as_utc_datetime(start)
+    end = start + timedelta(days=1) if end is None else _as_utc_datetime(end)
+    return {"start": start, "end": end}
+
+def bigquery_unique_stations(timefilter=None, inside_city=False, start=None, end=None):
+    """
+    Without a time filter the precomputed view is returned, otherwise the
+    stations crawled in the window, see `time_window`.
+    """
     sql_view = f"""
     SELECT * FROM `seli-data-storage.data_storage_1.unique_stations`
     """
 
-    # Basic SQL query without the ST_CONTAINS clause
+    # the points are built from lat/lon in one call, not parsed from WKT
+    params = time_window(timefilter, start, end)
+    if params is None:
+        return points_from_lonlat(
+            query_bigquery_return_gdf(sql_view, query_type="unique_stations")
+        )
+
+    # Basic SQL query without the ST_CONTAINS clause, the range on crawl_time
+    # lets BigQuery prune the partitions outside of the window
     sql = f"""
-    SELECT DISTINCT station_id, name, lat, lon
-    FROM `seli-data-storage.data_storage_1.station_information`
-    WHERE TIMESTAMP_TRUNC(crawl_time, DAY) = TIMESTAMP("{timefilter}") 
-    AND station_id LIKE '%nextbike%'
+    SELECT station_id, name, lat, lon
+    FROM (
+      SELECT DISTINCT station_id, name, lat, lon
+      FROM `seli-data-storage.data_storage_1.station_information`
+      WHERE crawl_time >= @start AND crawl_time < @end
+      AND station_id LIKE '%nextbike%'
+    )
     """
 
     # If inside_city is True, add the ST_CONTAINS clause
     if inside_city:
         sql += """
-        AND ST_CONTAINS((SELECT geometry
-                         FROM `seli-data-storage.data_storage_1.city`
-                         LIMIT 1), ST_GEOGPOINT(lon, lat))
+        WHERE ST_CONTAINS((SELECT geometry
+                           FROM `seli-data-storage.data_storage_1.city`
+                           LIMIT 1), ST_GEOGPOINT(lon, lat))
         """
 
-    return query_bigquery_return_gdf(sql_view)
+    return points_from_lonlat(
+        query_bigquery_return_df(sql, query_type="unique_stations", params=params)
+    )
 
 
 def bigquery_unique_bikes():
-    sql = f"""
-WITH FirstCrawlTime AS (
-  SELECT *
-  FROM `seli-data-storage.data_storage_1.nextbike_free_bike_status` AS s
-  ORDER BY s.crawl_time DESC
-  LIMIT 1
-)
+    """
+    The free bikes of the newest crawl as GeoDataFrame, shared by all
+    sessions for `SNAPSHOT_TTL` seconds, see `LatestSnapshot`.
+    """
+    return free_bike_status.get()
 
-SELECT *
-FROM `seli-data-storage.data_storage_1.nextbike_free_bike_status` AS s
-WHERE s.crawl_time = (SELECT crawl_time FROM FirstCrawlTime);
-  """
+def bigquery_station_status(start, end=None):
+    """
+    Streams the raw `station_status` crawls of the window, see `time_window`,
+    as DataFrame chunks so long windows are processed in bounded memory.
+    """
+    sql = f"""
+    SELECT station_id, provider_id, num_bikes_available, crawl_time
+    FROM `seli-data-storage.data_storage_1.station_status`
+    WHERE crawl_time >= @start AND crawl_time < @end
+    AND provider_id LIKE '%nextbike%'
+    """
 
-    return query_bigquery_return_df(sql)
+    return query_bigquery_iter_frames(
+        sql, params=time_window(start=start, end=end), query_type="station_status"
+    )
 
 def bigquery_city_boundary():
     sql = f"""
@@ -76,9 +149,13 @@ def bigquery_city_boundary():
     LIMIT 1
     """
 
-    return query_bigquery_return_gdf(sql)
+    return query_bigquery_return_gdf(sql, query_type="city_boundary")
 
-def bigquery_districts_and_stations(timefilter=datetime.now().strftime("%Y-%m-%d")):
+def bigquery_districts_and_stations(timefilter=None, start=None, end=None):
+    """
+    Without a time filter the precomputed view is returned, otherwise the
+    stations are counted for the window, see `time_window`.
+    """
     sql_view = f"""
       SELECT * FROM `seli-data-storage.data_storage_1.districts_and_stations`
     """
@@ -92,7 +169,7 @@ WITH DistinctStations AS (
   FROM
     `seli-data-storage.data_storage_1.station_information`
   WHERE
-    TIMESTAMP_TRUNC(crawl_time, DAY) = TIMESTAMP("{timefilter}")
+    crawl_time >= @start AND crawl_time < @end
     AND station_id LIKE '%nextbike%'
 ),
 StationPoints AS (
@@ -149,7 +226,13 @@ FROM
 
     """
 
-    return query_bigquery_return_gdf(sql_view)
+    params = time_window(timefilter, start, end)
+    if params is None:
+        return query_bigquery_return_gdf(sql_view, query_type="districts_and_stations")
+
+    return query_bigquery_return_gdf(
+        sql, query_type="districts_and_stations", params=params
+    )
 
 def bigquery_lakes_and_rivers():
     sql_view = f"""
@@ -189,7 +272,7 @@ WHERE
 
 """
 
-    return query_bigquery_return_gdf(sql_view)
+    return query_bigquery_return_gdf(sql_view, query_type="lakes_and_rivers")
 
 def bigquery_stations_and_bikes():
     sql_view = f"""
@@ -245,10 +328,10 @@ JOIN aggregated_station_status ass ON fsi.station_id = ass.station_id
 ORDER BY fsi.station_id, ass.hour_of_day;
 """
 
-    return query_bigquery_return_gdf(sql_view)
+    return query_bigquery_return_gdf(sql_view, query_type="stations_and_bikes")
 
 def bigquery_canton_boundary():
   sql = """ 
   SELECT * FROM `seli-data-storage.data_storage_1.canton`
 """
-  return query_bigquery_return_gdf(sql) 
\ No newline at end of file
+  return query_bigquery_return_gdf(sql, query_type="canton_boundary") 
\ No newline at end of file
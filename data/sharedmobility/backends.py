@@ -0,0 +1,518 @@
+import os
+import re
+import threading
+from datetime import date, datetime, timezone
+from google.cloud import bigquery
+from data.costs import DRY_RUN, MAX_BYTES_PER_QUERY, check_budget, costs
+from data.sharedmobility.client import BIGQUERY_PROJECT, get_bigquery_pool
+from data.sharedmobility.geometry import batch_to_frame
+
+try:
+    from google.cloud import bigquery_storage
+except ImportError:  # results are paged over REST without the Storage Read API
+    bigquery_storage = None
+
+# "bigquery" (default) or "duckdb" for the offline backend
+BACKEND = os.environ.get("SHAREDMOBILITY_BACKEND", "bigquery")
+
+# rows per Arrow record batch of a streamed query result
+STREAM_BATCH_SIZE = int(os.environ.get("SHAREDMOBILITY_STREAM_BATCH_SIZE", 100_000))
+
+# directory with the local Parquet/GeoJSONL files used by the duckdb backend
+LOCAL_DATA_DIR = os.environ.get("SHAREDMOBILITY_LOCAL_DIR", "data/local")
+
+BIGQUERY_DATASET = "data_storage_1"
+
+# base tables of the BigQuery dataset that the duckdb backend loads from files
+LOCAL_TABLES = [
+    "station_information",
+    "station_status",
+    "nextbike_free_bike_status",
+    "city",
+    "canton",
+    "districts",
+    "geo_rivers",
+    "lakes",
+]
+
+# the BigQuery views rebuilt on top of the local tables, with their dependencies
+LOCAL_VIEWS = {
+    "unique_stations": (
+        ["station_information", "city"],
+        """
+WITH LatestStations AS (
+  SELECT
+    station_id,
+    arg_max(name, crawl_time) AS name,
+    arg_max(lat, crawl_time) AS lat,
+    arg_max(lon, crawl_time) AS lon
+  FROM station_information
+  WHERE station_id LIKE '%nextbike%'
+  GROUP BY station_id
+)
+
+SELECT
+  s.station_id,
+  s.name,
+  s.lat,
+  s.lon,
+  ST_Point(s.lon, s.lat) AS geometry
+FROM LatestStations s, (SELECT geometry FROM city LIMIT 1) c
+WHERE ST_Contains(c.geometry, ST_Point(s.lon, s.lat))
+""",
+    ),
+    "districts_and_stations": (
+        ["station_information", "districts"],
+        """
+WITH StationPoints AS (
+  SELECT
+    station_id,
+    ST_Point(arg_max(lon, crawl_time), arg_max(lat, crawl_time)) AS station_point
+  FROM station_information
+  WHERE station_id LIKE '%nextbike%'
+  GROUP BY station_id
+),
+DistrictsWithCounts AS (
+  SELECT
+    d.name AS district_name,
+    COUNT(s.station_id) AS station_count
+  FROM districts d
+  LEFT JOIN StationPoints s
+  ON ST_Within(s.station_point, d.geometry)
+  GROUP BY d.name
+)
+
+SELECT
+  dc.district_name,
+  dc.station_count,
+  d.geometry,
+  d.u65,
+  d.z20_64,
+  d.z0_19,
+  d.diche_per_ha,
+  d.auslaender,
+  d.total
+FROM DistrictsWithCounts dc
+JOIN districts d ON dc.district_name = d.name
+""",
+    ),
+    "lakes_and_rivers": (
+        ["geo_rivers", "lakes", "canton"],
+        """
+SELECT
+  'river' AS type, -- Differentiates rivers from lakes
+  CAST(r.GROSSERFLU AS VARCHAR) AS GROSSERFLU, -- NAME OF RIVER
+  r.geometry
+FROM geo_rivers r, canton c
+WHERE
+  ST_Intersects(ST_StartPoint(r.geometry), c.geometry)
+  OR ST_Intersects(ST_EndPoint(r.geometry), c.geometry)
+
+UNION ALL
+
+SELECT
+  'lake' AS type, -- Differentiates lakes from rivers
+  CAST(l.ID1 AS VARCHAR), -- NAME OF LAKE
+  l.geometry
+FROM lakes l, canton c
+WHERE ST_Intersects(l.geometry, c.geometry)
+""",
+    ),
+    "stations_and_bikes": (
+        ["station_information", "station_status", "city"],
+        """
+WITH filtered_station_information AS (
+  SELECT
+    station_id,
+    arg_min(name, crawl_time) AS first_name,
+    arg_min(lat, crawl_time) AS first_lat,
+    arg_min(lon, crawl_time) AS first_lon
+  FROM station_information si, city cl
+  WHERE ST_Within(ST_Point(si.lon, si.lat), cl.geometry)
+  GROUP BY station_id
+),
+aggregated_station_status AS (
+  SELECT
+    station_id,
+    EXTRACT(HOUR FROM crawl_time) AS hour_of_day,
+    AVG(num_bikes_available) AS avg_num_bikes_available
+  FROM station_status
+  WHERE provider_id LIKE '%nextbike%'
+  AND EXTRACT(YEAR FROM crawl_time) = 2023
+  GROUP BY station_id, hour_of_day
+)
+
+SELECT
+  fsi.station_id,
+  ST_Point(fsi.first_lon, fsi.first_lat) AS geometry,
+  fsi.first_name AS name,
+  ass.hour_of_day,
+  ROUND(ass.avg_num_bikes_available, 2) AS avg_num_bikes_available
+FROM filtered_station_information fsi
+JOIN aggregated_station_status ass ON fsi.station_id = ass.station_id
+WHERE fsi.first_name NOT LIKE '%Teststation%'
+ORDER BY fsi.station_id, ass.hour_of_day
+""",
+    ),
+}
+
+
+class Backend:
+    """
+    Runs the SQL of the sharedmobility queries and returns the result.
+
+    Query parameters are written as `@name` in the SQL and passed as a dict
+    `params` of name -> value. `query_type` names the query in the cost
+    accounting, see `data.costs`.
+    """
+
+    name = None
+
+    def query_df(self, query, params=None, query_type=None):
+        raise NotImplementedError
+
+    def query_gdf(self, query, params=None, query_type=None):
+        raise NotImplementedError
+
+    def iter_batches(self, query, params=None, query_type=None):
+        """
+        Streams the result as Arrow record batches, geometries as WKT or WKB.
+        """
+        raise NotImplementedError
+
+    def iter_frames(self, query, params=None, geometry=None, query_type=None):
+        """
+        Streams the result as DataFrames, or GeoDataFrames if there are
+        geometry columns, one per record batch.
+        """
+        for batch in self.iter_batches(query, params, query_type=query_type):
+            yield batch_to_frame(batch, geometry=geometry)
+
+    def close(self):
+        pass
+
+
+def query_parameter(name, value):
+    """
+    Builds a BigQuery query parameter, the type is derived from the value.
+    """
+    # bool before int, datetime before date, they are subclasses
+    if isinstance(value, bool):
+        parameter_type = "BOOL"
+    elif isinstance(value, int):
+        parameter_type = "INT64"
+    elif isinstance(value, float):
+        parameter_type = "FLOAT64"
+    elif isinstance(value, datetime):
+        parameter_type = "TIMESTAMP"
+    elif isinstance(value, date):
+        parameter_type = "DATE"
+    elif isinstance(value, str):
+        parameter_type = "STRING"
+    else:
+        raise TypeError(f"Unsupported type of query parameter {name}: {type(value)}")
+    return bigquery.ScalarQueryParameter(name, parameter_type, value)
+
+
+def query_job_config(params=None, **options):
+    if not params and not options:
+        return None
+    return bigquery.QueryJobConfig(
+        query_parameters=[
+            query_parameter(name, value) for name, value in (params or {}).items()
+        ],
+        **options,
+    )
+
+
+class BigQueryBackend(Backend):
+    """
+    Runs queries on Google BigQuery with clients from the shared pool.
+
+    With a `MAX_BYTES_PER_QUERY` budget (or `DRY_RUN`) every query is
+    estimated with a dry run first and refused with `QueryBudgetExceeded` if
+    it would scan more than the budget.
+    The bytes, slot time and cache hits of the finished jobs are recorded
+    per query type in `data.costs.costs`.
+    """
+
+    name = "bigquery"
+
+    def __init__(self, pool=None):
+        self._pool = pool
+        self._read_client = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        return self._pool or get_bigquery_pool()
+
+    def read_client(self, client):
+        """
+        Returns the shared Storage Read API client, or None if
+        google-cloud-bigquery-storage is not installed.
+        """
+        if bigquery_storage is None:
+            return None
+        if self._read_client is None:
+            with self._lock:
+                if self._read_client is None:
+                    self._read_client = bigquery_storage.BigQueryReadClient(
+                        credentials=client._credentials
+                    )
+        return self._read_client
+
+    def estimate(self, client, query, params=None):
+        """
+        Returns the bytes the query would process, from a dry run that is
+        neither billed nor executed.
+        """
+        dry_run = client.query(query, job_config=query_job_config(params, dry_run=True))
+        return dry_run.total_bytes_processed or 0
+
+    def _run(self, client, query, params, query_type, **result_options):
+        if DRY_RUN or MAX_BYTES_PER_QUERY:
+            estimated_bytes = self.estimate(client, query, params)
+            costs.record_estimate(query_type, estimated_bytes)
+            check_budget(query_type, estimated_bytes)
+
+        query_job = client.query(query, job_config=query_job_config(params))
+        results = query_job.result(**result_options)
+        costs.record_job(query_type, query_job)
+        return results
+
+    def query_df(self, query, params=None, query_type=None):
+        with self.pool.connection() as client:
+            return self._run(client, query, params, query_type).to_dataframe()
+
+    def query_gdf(self, query, params=None, query_type=None):
+        with self.pool.connection() as client:
+            return self._run(client, query, params, query_type).to_geodataframe()
+
+    def iter_batches(self, query, params=None, query_type=None):
+        # the client stays checked out until the stream is exhausted or closed
+        with self.pool.connection() as client:
+            results = self._run(
+                client, query, params, query_type, page_size=STREAM_BATCH_SIZE
+            )
+
+            yield from results.to_arrow_iterable(bqstorage_client=self.read_client(client))
+
+    def close(self):
+        if self._read_client is not None:
+            self._read_client.transport.close()
+            self._read_client = None
+
+
+def duckdb_parameters(params):
+    """
+    Passes timestamps as naive UTC, the type the local tables store them in.
+    """
+    if not params:
+        return None
+    return {
+        name: value.astimezone(timezone.utc).replace(tzinfo=None)
+        if isinstance(value, datetime) and value.tzinfo is not None
+        else value
+        for name, value in params.items()
+    }
+
+
+def translate_bigquery_sql(query):
+    """
+    Rewrites the BigQuery specific parts of the sharedmobility SQL for DuckDB.
+    """
+    query = re.sub(
+        rf"`{BIGQUERY_PROJECT}\.{BIGQUERY_DATASET}\.(\w+)`", r"\1", query
+    )
+    query = re.sub(r"\bST_GEOGPOINT\b", "ST_Point", query, flags=re.IGNORECASE)
+    # named query parameters are written @name in BigQuery and $name in DuckDB
+    query = re.sub(r"@(\w+)", r"$\1", query)
+    return query
+
+
+class DuckDBBackend(Backend):
+    """
+    Offline backend that runs the sharedmobility SQL with DuckDB and its
+    spatial extension on local files instead of BigQuery.
+
+    Every table of the BigQuery dataset is read from `<table>.parquet` (WKB
+    geometry) or `<table>.geojsonl` in `directory`. The views used by the app
+    are created on top of those tables, unless a file with the name of the
+    view exists, e.g. an export of the BigQuery view. Timestamps are stored
+    as naive UTC, whether the files have them with or without time zone, and
+    timestamp parameters are converted to match.
+
+    Args:
+    directory (str): Directory with the local table files.
+    database (str): DuckDB database file, in memory by default.
+    """
+
+    name = "duckdb"
+
+    def __init__(self, directory=LOCAL_DATA_DIR, database=":memory:"):
+        import duckdb
+
+        self.directory = directory
+        self._con = duckdb.connect(database)
+        try:
+            self._con.load_extension("spatial")
+        except duckdb.Error:
+            # only downloaded if it is not installed yet, e.g. offline setups
+            # provision it beforehand
+            self._con.install_extension("spatial")
+            self._con.load_extension("spatial")
+        self._lock = threading.Lock()
+        self.tables = set()
+
+        for table in LOCAL_TABLES + list(LOCAL_VIEWS):
+            if self._load_table(table):
+                self.tables.add(table)
+        for view, (dependencies, sql) in LOCAL_VIEWS.items():
+            if view not in self.tables and self.tables.issuperset(dependencies):
+                self._con.execute(f"CREATE OR REPLACE VIEW {view} AS {sql}")
+                self.tables.add(view)
+
+    def _load_table(self, table):
+        parquet_path = os.path.join(self.directory, f"{table}.parquet")
+        geojsonl_path = os.path.join(self.directory, f"{table}.geojsonl")
+
+        if os.path.exists(parquet_path):
+            source = f"read_parquet('{parquet_path}')"
+            columns = self._con.sql(f"SELECT * FROM {source}").columns
+            if "geometry" in columns:
+                source = (
+                    f"(SELECT * REPLACE (ST_GeomFromWKB(geometry) AS geometry) "
+                    f"FROM {source})"
+                )
+        elif os.path.exists(geojsonl_path):
+            source = (
+                f"(SELECT * EXCLUDE (geom), geom AS geometry "
+                f"FROM ST_Read('{geojsonl_path}'))"
+            )
+        else:
+            return False
+
+        relation = self._con.sql(f"SELECT * FROM {source}")
+        timestamp_columns = [
+            column
+            for column, column_type in zip(relation.columns, relation.types)
+            if str(column_type) == "TIMESTAMP WITH TIME ZONE"
+        ]
+        if timestamp_columns:
+            source = (
+                "(SELECT * REPLACE ("
+                + ", ".join(
+                    f"timezone('UTC', \"{column}\") AS \"{column}\""
+                    for column in timestamp_columns
+                )
+                + f") FROM {source})"
+            )
+
+        self._con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM {source}")
+        return True
+
+    def _relation(self, cursor, query, params, geometry_format):
+        relation = cursor.sql(translate_bigquery_sql(query), params=duckdb_parameters(params))
+        geometry_columns = [
+            column
+            for column, column_type in zip(relation.columns, relation.types)
+            if str(column_type) == "GEOMETRY"
+        ]
+        if geometry_columns:
+            relation = relation.project(
+                ", ".join(
+                    f'{geometry_format}("{column}") AS "{column}"'
+                    if column in geometry_columns
+                    else f'"{column}"'
+                    for column in relation.columns
+                )
+            )
+        return relation, geometry_columns
+
+    def query_df(self, query, params=None, query_type=None):
+        # geometries are returned as WKT, like BigQuery does for GEOGRAPHY
+        with self._lock:
+            cursor = self._con.cursor()
+        try:
+            relation, _ = self._relation(cursor, query, params, "ST_AsText")
+            return relation.df()
+        finally:
+            cursor.close()
+
+    def query_gdf(self, query, params=None, query_type=None):
+        with self._lock:
+            cursor = self._con.cursor()
+        try:
+            relation, geometry_columns = self._relation(
+                cursor, query, params, "ST_AsWKB"
+            )
+            if not geometry_columns:
+                raise ValueError("The query does not return a geometry column.")
+            table = relation.arrow()
+        finally:
+            cursor.close()
+
+        return batch_to_frame(table, geometry=geometry_columns)
+
+    def iter_batches(self, query, params=None, query_type=None):
+        with self._lock:
+            cursor = self._con.cursor()
+        try:
+            relation, _ = self._relation(cursor, query, params, "ST_AsWKB")
+            yield from relation.record_batch(STREAM_BATCH_SIZE)
+        finally:
+            cursor.close()
+
+    def iter_frames(self, query, params=None, geometry=None, query_type=None):
+        # the schema of a DuckDB result does not mark the geometry columns
+        with self._lock:
+            cursor = self._con.cursor()
+        try:
+            relation, geometry_columns = self._relation(cursor, query, params, "ST_AsWKB")
+            if geometry is None:
+                geometry = geometry_columns
+            for batch in relation.record_batch(STREAM_BATCH_SIZE):
+                yield batch_to_frame(batch, geometry=geometry)
+        finally:
+            cursor.close()
+
+    def close(self):
+        self._con.close()
+
+
+BACKENDS = {
+    BigQueryBackend.name: BigQueryBackend,
+    DuckDBBackend.name: DuckDBBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Returns the process-wide backend selected with SHAREDMOBILITY_BACKEND.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if BACKEND not in BACKENDS:
+                    raise ValueError(
+                        f"Invalid backend {BACKEND!r}. Please choose one of {list(BACKENDS)}."
+                    )
+                _backend = BACKENDS[BACKEND]()
+    return _backend
+
+
+def set_backend(backend):
+    """
+    Replaces the process-wide backend, e.g. with a DuckDBBackend on fixture
+    data. The previous backend is closed.
+    """
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    if previous is not None and previous is not backend:
+        previous.close()
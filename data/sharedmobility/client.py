@@ -0,0 +1,206 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+import requests
+from google.api_core import exceptions as api_exceptions
+from google.auth import exceptions as auth_exceptions
+from google.auth.transport.requests import Request
+from google.cloud import bigquery
+
+BIGQUERY_PROJECT = "seli-data-storage"
+
+# number of clients kept per process, one per dataset load_data() fires
+BIGQUERY_POOL_SIZE = int(os.environ.get("BIGQUERY_POOL_SIZE", 6))
+
+# clients idle for longer than this are checked before they are handed out again
+BIGQUERY_POOL_IDLE_CHECK = float(os.environ.get("BIGQUERY_POOL_IDLE_CHECK", 300))
+
+# failures of the client itself, its connection or credentials. a client that
+# raised one of them is replaced, after any other error it is reused
+CLIENT_FAILURES = (
+    auth_exceptions.GoogleAuthError,
+    api_exceptions.Unauthorized,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.RetryError,
+    requests.exceptions.ConnectionError,
+)
+
+
+def create_bigquery_connection():
+    service_account_key_path = "service_key.json"
+
+    if os.path.exists(service_account_key_path):
+        return bigquery.Client.from_service_account_json(
+            service_account_key_path, project=BIGQUERY_PROJECT
+        )
+    else:
+        return bigquery.Client(project=BIGQUERY_PROJECT)
+
+
+def client_is_healthy(client):
+    """
+    Checks that the credentials of an idle client are still usable, refreshing
+    them if needed so the next query does not pay for the token round-trip.
+    """
+    credentials = getattr(client, "_credentials", None)
+    if credentials is None:
+        return False
+    if not credentials.valid:
+        try:
+            credentials.refresh(Request())
+        except Exception:
+            return False
+    return True
+
+
+class BigQueryClientPool:
+    """
+    Thread-safe pool of reusable BigQuery clients.
+
+    Clients are created lazily through `factory` up to `size`, handed out with
+    `connection()` and returned afterwards. A client that raised one of
+    `CLIENT_FAILURES` while in use, or that fails `health_check` after being
+    idle, is closed and replaced.
+
+    Args:
+    factory (callable): Returns a new client, e.g. `create_bigquery_connection`.
+    size (int): Maximum number of clients alive at the same time.
+    health_check (callable): Returns False if a client must be replaced.
+    idle_check (float): Seconds a client may stay idle before it is checked.
+    """
+
+    def __init__(
+        self,
+        factory=create_bigquery_connection,
+        size=BIGQUERY_POOL_SIZE,
+        health_check=client_is_healthy,
+        idle_check=BIGQUERY_POOL_IDLE_CHECK,
+    ):
+        if size < 1:
+            raise ValueError("The pool size must be at least 1.")
+        self.factory = factory
+        self.size = size
+        self.health_check = health_check
+        self.idle_check = idle_check
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+    @property
+    def created(self):
+        return self._created
+
+    def _create(self):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The BigQuery client pool is closed.")
+            if self._created >= self.size:
+                return None
+            self._created += 1
+        try:
+            return self.factory()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _discard(self, client):
+        with self._lock:
+            self._created -= 1
+        close = getattr(client, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+
+    def acquire(self, timeout=None):
+        while True:
+            try:
+                client, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                client = self._create()
+                if client is not None:
+                    return client
+                # pool is exhausted, wait for a client to be released
+                try:
+                    client, released_at = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError(
+                        f"No BigQuery client available after {timeout} seconds."
+                    )
+
+            if self._closed:
+                self._discard(client)
+                raise RuntimeError("The BigQuery client pool is closed.")
+            idle = time.monotonic() - released_at
+            if idle < self.idle_check or self.health_check(client):
+                return client
+            self._discard(client)
+
+    def release(self, client, broken=False):
+        if broken or self._closed:
+            self._discard(client)
+        else:
+            self._idle.put((client, time.monotonic()))
+
+    @contextmanager
+    def connection(self, timeout=None):
+        client = self.acquire(timeout=timeout)
+        broken = False
+        try:
+            yield client
+        except CLIENT_FAILURES:
+            broken = True
+            raise
+        finally:
+            # also on GeneratorExit, when a stream holding the client is closed early
+            self.release(client, broken=broken)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                client, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(client)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_bigquery_pool():
+    """
+    Returns the process-wide client pool, creating it on first use.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = BigQueryClientPool()
+    return _pool
+
+
+def set_bigquery_pool(pool):
+    """
+    Replaces the process-wide pool, e.g. with one built around a fake client
+    factory. The previous pool is closed.
+    """
+    global _pool
+    with _pool_lock:
+        previous, _pool = _pool, pool
+    if previous is not None and previous is not pool:
+        previous.close()
+
+
+def close_bigquery_pool():
+    set_bigquery_pool(None)
+
+
+atexit.register(close_bigquery_pool)
@@ -0,0 +1,76 @@
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import shapely
+from data.crs import EPSG_GLOBAL
+
+# extension type BigQuery sets on GEOGRAPHY columns of its Arrow results
+GEOGRAPHY_EXTENSION = b"google:sqlType:geography"
+
+
+def geometry_columns(schema):
+    """
+    Returns the names of the GEOGRAPHY columns of an Arrow schema.
+    """
+    return [
+        field.name
+        for field in schema
+        if (field.metadata or {}).get(b"ARROW:extension:name") == GEOGRAPHY_EXTENSION
+    ]
+
+
+def geometry_from_arrow(column):
+    """
+    Parses a WKB (binary) or WKT (string) Arrow column into a numpy array of
+    shapely geometries with one vectorized call.
+    """
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    values = column.to_numpy(zero_copy_only=False)
+    if pa.types.is_binary(column.type) or pa.types.is_large_binary(column.type):
+        return shapely.from_wkb(values)
+    return shapely.from_wkt(values)
+
+
+def points_from_lonlat(df, lon="lon", lat="lat", crs=EPSG_GLOBAL):
+    """
+    Returns `df` as GeoDataFrame with point geometries built in one
+    vectorized call from its longitude and latitude columns. An existing
+    `geometry` column is replaced.
+    """
+    geometry = gpd.points_from_xy(
+        df[lon].to_numpy(dtype=float), df[lat].to_numpy(dtype=float), crs=crs
+    )
+    frame = pd.DataFrame(df.drop(columns="geometry", errors="ignore"))
+    return gpd.GeoDataFrame(frame, geometry=geometry, crs=crs)
+
+
+def batch_to_frame(batch, geometry=None, crs=EPSG_GLOBAL):
+    """
+    Converts an Arrow record batch or table to a DataFrame, or to a
+    GeoDataFrame if it has geometry columns.
+
+    Args:
+    batch (RecordBatch or Table): The Arrow data.
+    geometry (list): Names of the geometry columns, detected from the schema
+        if not given.
+    crs (str): CRS of the geometries.
+    """
+    table = pa.Table.from_batches([batch]) if isinstance(batch, pa.RecordBatch) else batch
+    columns = geometry_columns(table.schema) if geometry is None else list(geometry)
+    columns = [column for column in columns if column in table.column_names]
+    if not columns:
+        return table.to_pandas()
+
+    df = table.select(
+        [column for column in table.column_names if column not in columns]
+    ).to_pandas()
+    for column in columns:
+        df[column] = gpd.GeoSeries(
+            geometry_from_arrow(table.column(column)), index=df.index, crs=crs
+        )
+    # keep the column order of the query
+    df = df[table.column_names]
+
+    active = "geometry" if "geometry" in columns else columns[0]
+    return gpd.GeoDataFrame(df, geometry=active, crs=crs)
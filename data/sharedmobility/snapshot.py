@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+from data.sharedmobility.backends import get_backend
+from data.sharedmobility.geometry import points_from_lonlat
+
+# seconds a fetched snapshot is served to every session before it is fetched again
+SNAPSHOT_TTL = float(os.environ.get("SHAREDMOBILITY_SNAPSHOT_TTL", 60))
+
+# how far back the first fetch looks for the newest crawl, about one partition
+SNAPSHOT_LOOKBACK = timedelta(days=1)
+
+SQL_LATEST_FREE_BIKE_STATUS = """
+SELECT *
+FROM `seli-data-storage.data_storage_1.nextbike_free_bike_status`
+WHERE crawl_time >= @since
+QUALIFY crawl_time = MAX(crawl_time) OVER ()
+"""
+
+
+class LatestSnapshot:
+    """
+    The newest crawl of a crawled table, e.g. the live free bike positions.
+
+    Instead of ordering the whole table by `crawl_time`, only the crawls at
+    or after the high-watermark (the newest `crawl_time` seen so far) are
+    read, which BigQuery prunes to the newest partition. The snapshot is
+    kept in memory for `ttl` seconds and concurrent callers share a single
+    fetch.
+
+    Args:
+    sql (str): Query with a `@since` parameter returning the newest crawl.
+    ttl (float): Seconds a snapshot is served without asking the backend.
+    lookback (timedelta): Window searched when no watermark is known yet.
+    transform (callable): Applied once to every fetched snapshot.
+    query_type (str): Name of the query in the cost accounting.
+    """
+
+    def __init__(
+        self, sql, ttl=SNAPSHOT_TTL, lookback=SNAPSHOT_LOOKBACK, transform=None, query_type=None
+    ):
+        self.sql = sql
+        self.query_type = query_type
+        self.transform = transform
+        self.ttl = ttl
+        self.lookback = lookback
+        self.watermark = None
+        self.data = None
+        self.fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    def is_fresh(self):
+        return self.data is not None and time.monotonic() - self.fetched_at < self.ttl
+
+    def _fetch(self, backend):
+        since = self.watermark
+        if since is None:
+            since = datetime.now(timezone.utc) - self.lookback
+        data = backend.query_df(
+            self.sql, params={"since": since}, query_type=self.query_type
+        )
+        if data.empty and self.watermark is None:
+            # nothing crawled within the lookback, search the whole table once
+            data = backend.query_df(
+                self.sql,
+                params={"since": datetime(1970, 1, 1, tzinfo=timezone.utc)},
+                query_type=self.query_type,
+            )
+        return data
+
+    def get(self, backend=None):
+        """
+        Returns the newest crawl as DataFrame.
+        """
+        if self.is_fresh():
+            return self.data
+        with self._lock:
+            # another caller may have fetched it while we waited
+            if self.is_fresh():
+                return self.data
+            data = self._fetch(backend or get_backend())
+            if not data.empty:
+                crawl_time = pd.to_datetime(data["crawl_time"], utc=True).max()
+                self.watermark = crawl_time.to_pydatetime()
+            if not data.empty or self.data is None:
+                self.data = self.transform(data) if self.transform else data
+            # without newer crawls the previous snapshot stays current
+            self.fetched_at = time.monotonic()
+            return self.data
+
+    def clear(self):
+        with self._lock:
+            self.watermark = None
+            self.data = None
+            self.fetched_at = 0.0
+
+
+# the bike positions come as lat/lon columns, the points are built once per fetch
+free_bike_status = LatestSnapshot(
+    SQL_LATEST_FREE_BIKE_STATUS, transform=points_from_lonlat, query_type="unique_bikes"
+)
@@ -0,0 +1,174 @@
+import numpy as np
+import shapely
+from pyproj import Transformer
+from data.crs import EPSG_GLOBAL, EPSG_SWISS
+
+# smallest search radius in meters, for query points right on a station
+MIN_SEARCH_RADIUS = 1.0
+
+_global_to_swiss = Transformer.from_crs(EPSG_GLOBAL, EPSG_SWISS, always_xy=True)
+
+
+def lonlat_to_swiss(lon, lat):
+    """
+    Vectorized conversion of WGS84 longitudes/latitudes to swiss coordinates.
+    """
+    return _global_to_swiss.transform(np.asarray(lon), np.asarray(lat))
+
+
+class StationIndex:
+    """
+    Nearest-neighbour index over the station coordinates.
+
+    The stations are kept in an STRtree in the swiss CRS. A query starts at
+    the distance of the nearest station and widens the search radius until it
+    holds k stations, so only the stations close to a point are compared,
+    regardless of the station count.
+
+    Args:
+    stations (GeoDataFrame): Point geometries of the stations.
+    """
+
+    def __init__(self, stations):
+        if stations.crs is not None and stations.crs != EPSG_SWISS:
+            stations = stations.to_crs(crs=EPSG_SWISS)
+        self.stations = stations
+        self.coords = np.column_stack(
+            [stations.geometry.x.to_numpy(), stations.geometry.y.to_numpy()]
+        )
+        self.tree = shapely.STRtree(shapely.points(self.coords))
+
+    def __len__(self):
+        return len(self.coords)
+
+    def query(self, x, y, k=3):
+        """
+        Finds the k nearest stations for many points in the swiss CRS.
+
+        Returns:
+        tuple: `(distances, positions)`, arrays of shape (points, k) sorted by
+            distance, with the distances in meters and the row positions of
+            the stations.
+        """
+        coords = np.column_stack([np.atleast_1d(x), np.atleast_1d(y)]).astype(float)
+        k = min(k, len(self.coords))
+        distances = np.empty((len(coords), k))
+        positions = np.empty((len(coords), k), dtype=np.intp)
+        if k == 0 or len(coords) == 0:
+            return distances, positions
+
+        points = shapely.points(coords)
+        radius = np.empty(len(coords))
+        (point_positions, _), nearest = self.tree.query_nearest(
+            points, return_distance=True, all_matches=False
+        )
+        radius[point_positions] = np.maximum(nearest, MIN_SEARCH_RADIUS)
+
+        pending = np.arange(len(coords))
+        while len(pending):
+            # every station within the radius, grouped by query point
+            point_positions, station_positions = self.tree.query(
+                points[pending], predicate="dwithin", distance=radius[pending]
+            )
+            order = np.argsort(point_positions, kind="stable")
+            counts = np.bincount(point_positions, minlength=len(pending))
+            groups = np.split(station_positions[order], np.cumsum(counts)[:-1])
+
+            done = counts >= k
+            for i in np.flatnonzero(done):
+                candidates = groups[i]
+                delta = self.coords[candidates] - coords[pending[i]]
+                candidate_distances = np.hypot(delta[:, 0], delta[:, 1])
+                # the k nearest within the radius are the k nearest overall
+                best = np.argsort(candidate_distances, kind="stable")[:k]
+                positions[pending[i]] = candidates[best]
+                distances[pending[i]] = candidate_distances[best]
+
+            pending = pending[~done]
+            radius[pending] *= 2
+
+        return distances, positions
+
+    def query_lonlat(self, lon, lat, k=3):
+        """
+        Same as `query` for points given as WGS84 longitudes/latitudes.
+        """
+        x, y = lonlat_to_swiss(lon, lat)
+        return self.query(x, y, k=k)
+
+    def nearest(self, lon, lat, k=3):
+        """
+        Returns the k nearest stations to one WGS84 location.
+
+        Returns:
+        GeoDataFrame: The k stations sorted by distance, with a `distance`
+            column in meters.
+        """
+        distances, positions = self.query_lonlat(lon, lat, k=k)
+        nearest = self.stations.iloc[positions[0]].reset_index(drop=True)
+        nearest["distance"] = distances[0]
+        return nearest
+
+
+def distance_to_nearest(geometries, targets):
+    """
+    Distance from every geometry to the closest of the target geometries,
+    found with an STRtree over the targets instead of comparing all pairs.
+
+    Returns:
+    ndarray: One distance per geometry in the units of the CRS, `inf` for
+        empty geometries or if there are no targets.
+    """
+    geometries = np.asarray(geometries)
+    distances = np.full(len(geometries), np.inf)
+    targets = np.asarray(targets)
+    if len(geometries) == 0 or len(targets) == 0:
+        return distances
+
+    tree = shapely.STRtree(targets)
+    (positions, _), nearest = tree.query_nearest(
+        geometries, return_distance=True, all_matches=False
+    )
+    distances[positions] = nearest
+    return distances
+
+
+class ProximityIndex:
+    """
+    Distance of every feature to the closest target, e.g. of every station to
+    the closest lake or river, computed once.
+
+    The distances are kept sorted, so selecting all features within a maximum
+    distance is a binary search instead of a new spatial query.
+
+    Args:
+    features (GeoDataFrame): The features to filter, e.g. the stations.
+    targets (GeoDataFrame): The targets to measure the distance to, they are
+        reprojected to the CRS of `features` if needed.
+    """
+
+    def __init__(self, features, targets):
+        if targets.crs is not None and features.crs != targets.crs:
+            targets = targets.to_crs(crs=features.crs)
+        self.features = features
+        self.distances = distance_to_nearest(
+            features.geometry.values, targets.geometry.values
+        )
+        self._order = np.argsort(self.distances, kind="stable")
+        self._sorted = self.distances[self._order]
+
+    def count_within(self, max_distance):
+        return int(np.searchsorted(self._sorted, max_distance, side="right"))
+
+    def positions_within(self, max_distance):
+        """
+        Row positions of the features at most `max_distance` away from any
+        target, in their original order.
+        """
+        return np.sort(self._order[: self.count_within(max_distance)])
+
+    def within(self, max_distance):
+        """
+        Returns the features at most `max_distance` away from any target.
+        """
+        return self.features.iloc[self.positions_within(max_distance)]
@@ -0,0 +1,241 @@
+import os
+import threading
+import time
+from functools import lru_cache
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import CRS, Transformer
+from data.cache import CACHE_TTL, max_cache_age
+from data.crs import EPSG_GLOBAL, EPSG_SWISS
+from data.tracing import span
+
+# seconds before the loaded datasets are refreshed in the background
+DATASET_TTL = float(os.environ.get("SHAREDMOBILITY_DATASET_TTL", CACHE_TTL))
+
+# string columns with at most this share of distinct values become categorical
+CATEGORY_MAX_RATIO = 0.5
+
+
+def compact(frame, category_max_ratio=CATEGORY_MAX_RATIO):
+    """
+    Returns `frame` with smaller dtypes for its attribute columns: repetitive
+    strings as categorical, other strings backed by Arrow and integers
+    downcast to the smallest type holding their values. Floats are kept as
+    they are, the displayed averages must not change.
+    """
+    columns = {}
+    geometry = frame.geometry.name if isinstance(frame, gpd.GeoDataFrame) else None
+    for column in frame.columns:
+        series = frame[column]
+        if column == geometry:
+            continue
+        if pd.api.types.infer_dtype(series, skipna=True) == "string":
+            if series.nunique() <= category_max_ratio * len(series):
+                columns[column] = series.astype("category")
+            else:
+                columns[column] = series.astype("string[pyarrow]")
+        elif pd.api.types.is_integer_dtype(series):
+            columns[column] = pd.to_numeric(series, downcast="integer")
+    if not columns:
+        return frame
+    # only the converted columns are new, the geometries are not copied
+    frame = frame.copy(deep=False)
+    for column, series in columns.items():
+        frame[column] = series
+    return frame
+
+
+@lru_cache(maxsize=None)
+def _transformer(source, target):
+    return Transformer.from_crs(source, target, always_xy=True)
+
+
+def reproject(gdf, crs):
+    """
+    Reprojects the geometries of `gdf` with one vectorized pyproj call over
+    all coordinates. The attribute columns are shared with `gdf`, not copied.
+    """
+    crs = CRS.from_user_input(crs)
+    if gdf.crs is None:
+        raise ValueError("Cannot reproject a GeoDataFrame without a CRS.")
+    if gdf.crs.is_exact_same(crs):
+        return gdf
+
+    transformer = _transformer(gdf.crs.to_wkt(), crs.to_wkt())
+
+    def transform(coords):
+        x, y = transformer.transform(coords[:, 0], coords[:, 1])
+        return np.column_stack([x, y])
+
+    with span("reproject", crs=crs.to_string(), rows=len(gdf)):
+        geometries = shapely.transform(np.asarray(gdf.geometry.values), transform)
+        frame = gdf.copy(deep=False)
+        frame[gdf.geometry.name] = gpd.GeoSeries(geometries, index=gdf.index, crs=crs)
+    return frame
+
+
+class Dataset:
+    """
+    One layer held in the swiss and in the global CRS.
+
+    The frame in the CRS it was loaded in is kept, the other projection is
+    built on first access and then kept as well. Both frames share the same
+    compacted attribute columns, see `compact`. They are shared by all
+    callers and must be treated as read-only, copy before modifying.
+
+    Args:
+    gdf (GeoDataFrame): The layer in EPSG:2056 or EPSG:4326.
+    """
+
+    def __init__(self, gdf):
+        self._frames = {}
+        self._lock = threading.Lock()
+        gdf = compact(gdf)
+        if gdf.crs is not None and gdf.crs.is_exact_same(CRS.from_user_input(EPSG_GLOBAL)):
+            self._frames[EPSG_GLOBAL] = gdf
+        else:
+            self._frames[EPSG_SWISS] = reproject(gdf, EPSG_SWISS)
+
+    def _frame(self, crs):
+        frame = self._frames.get(crs)
+        if frame is None:
+            with self._lock:
+                frame = self._frames.get(crs)
+                if frame is None:
+                    source = next(iter(self._frames.values()))
+                    frame = self._frames[crs] = reproject(source, crs)
+        return frame
+
+    @property
+    def swiss(self):
+        return self._frame(EPSG_SWISS)
+
+    @property
+    def wgs84(self):
+        return self._frame(EPSG_GLOBAL)
+
+    def __len__(self):
+        return len(next(iter(self._frames.values())))
+
+
+class DatasetStore:
+    """
+    Read-only container of the loaded layers, e.g. `store["unique_stations"].swiss`.
+
+    Objects derived from the layers, e.g. spatial indexes, are memoized per
+    store with `derived`, so they are rebuilt together with the data.
+
+    Args:
+    datasets (dict): Layer name -> GeoDataFrame.
+    """
+
+    def __init__(self, datasets):
+        self._datasets = {name: Dataset(gdf) for name, gdf in datasets.items()}
+        self._derived = {}
+        # reentrant, a derived object may be built from other derived objects
+        self._lock = threading.RLock()
+        self.loaded_at = time.time()
+
+    def derived(self, name, build):
+        """
+        Returns the object stored as `name`, built with `build(store)` on
+        first use.
+        """
+        value = self._derived.get(name)
+        if value is None:
+            with self._lock:
+                value = self._derived.get(name)
+                if value is None:
+                    value = self._derived[name] = build(self)
+        return value
+
+    def __getitem__(self, name):
+        return self._datasets[name]
+
+    def __contains__(self, name):
+        return name in self._datasets
+
+    def __iter__(self):
+        return iter(self._datasets)
+
+    def __len__(self):
+        return len(self._datasets)
+
+
+class DatasetRegistry:
+    """
+    Process-wide holder of the current DatasetStore.
+
+    The first `get` loads the datasets, later calls return the shared store
+    without waiting. Once it is older than `ttl` seconds, the stale store is
+    still returned while a single background thread loads the new one and
+    swaps it in. A failed refresh keeps the stale store and is retried on
+    the next call after `retry` seconds. While loading, cached query results
+    older than `ttl` are ignored, so a refresh does not re-read the same
+    results from the disk cache.
+
+    Args:
+    load (callable): Returns the datasets as dict of name -> GeoDataFrame.
+    ttl (float): Seconds before a store is refreshed.
+    retry (float): Seconds to wait after a failed refresh.
+    """
+
+    def __init__(self, load, ttl=DATASET_TTL, retry=60):
+        self.load = load
+        self.ttl = ttl
+        self.retry = retry
+        self.error = None
+        self._store = None
+        self._failed_at = 0.0
+        self._refreshing = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with max_cache_age(self.ttl):
+            return DatasetStore(self.load())
+
+    def _refresh(self):
+        try:
+            store = self._load()
+        except Exception as e:
+            with self._lock:
+                self.error = e
+                self._failed_at = time.time()
+                self._refreshing = None
+            return
+        with self._lock:
+            self._store = store
+            self.error = None
+            self._refreshing = None
+
+    def is_stale(self, store):
+        now = time.time()
+        return now - store.loaded_at >= self.ttl and now - self._failed_at >= self.retry
+
+    def get(self):
+        store = self._store
+        if store is None:
+            with self._lock:
+                if self._store is None:
+                    # nothing to serve yet, the first caller loads synchronously
+                    self._store = self._load()
+                store = self._store
+        if self.is_stale(store):
+            with self._lock:
+                if self._refreshing is None and self._store is store:
+                    self._refreshing = threading.Thread(
+                        target=self._refresh, name="dataset-refresh", daemon=True
+                    )
+                    self._refreshing.start()
+        return store
+
+    def refresh(self):
+        """
+        Loads the datasets now and swaps in the new store.
+        """
+        self._refresh()
+        if self.error is not None:
+            raise self.error
+        return self._store
@@ -0,0 +1,212 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# log every finished span as one JSON line on the "sharedmobility.trace" logger
+TRACE_LOG = os.environ.get("SHAREDMOBILITY_TRACE_LOG", "") not in ("", "0", "false")
+
+# upper bounds in seconds of the duration histogram buckets of the export
+TRACE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+logger = logging.getLogger("sharedmobility.trace")
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_current_span = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    """
+    One timed step, e.g. a query or a layer.
+
+    Attributes:
+    name (str): What was timed, e.g. "query" or "layer.coverage".
+    attributes (dict): Details like the query type or the payload bytes.
+    parent (Span): The enclosing span, None at the top.
+    start (float): `time.perf_counter()` at the start.
+    duration (float): Seconds, None while running.
+    """
+
+    def __init__(self, name, attributes, parent):
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.start = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "duration": self.duration,
+            "depth": self.depth,
+            **self.attributes,
+        }
+
+
+class Trace:
+    """
+    The spans of one unit of work, e.g. one Streamlit rerun, in start order.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.spans = []
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    @property
+    def duration(self):
+        return time.perf_counter() - self.start
+
+    def to_records(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        return [span.to_dict() for span in spans if span.duration is not None]
+
+
+class SpanStats:
+    """
+    Process-wide count, duration histogram and byte totals per span name.
+    """
+
+    def __init__(self, buckets=TRACE_BUCKETS):
+        self.buckets = buckets
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        with self._lock:
+            stats = self._stats.setdefault(
+                span.name,
+                {"count": 0, "sum": 0.0, "bytes": 0, "buckets": [0] * len(self.buckets)},
+            )
+            stats["count"] += 1
+            stats["sum"] += span.duration
+            stats["bytes"] += span.attributes.get("bytes") or 0
+            for i, bound in enumerate(self.buckets):
+                if span.duration <= bound:
+                    stats["buckets"][i] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: dict(stats, buckets=list(stats["buckets"]))
+                for name, stats in self._stats.items()
+            }
+
+    def openmetrics(self, extra=""):
+        """
+        Returns the statistics in the OpenMetrics text format, followed by
+        the metric families in `extra`.
+        """
+        lines = [
+            "# TYPE sharedmobility_span_seconds histogram",
+            "# UNIT sharedmobility_span_seconds seconds",
+            "# HELP sharedmobility_span_seconds Duration of the traced steps.",
+        ]
+        snapshot = self.snapshot()
+        for name, stats in sorted(snapshot.items()):
+            for bound, count in zip(self.buckets, stats["buckets"]):
+                lines.append(
+                    f'sharedmobility_span_seconds_bucket{{span="{name}",le="{bound}"}} {count}'
+                )
+            lines.append(
+                f'sharedmobility_span_seconds_bucket{{span="{name}",le="+Inf"}} {stats["count"]}'
+            )
+            lines.append(f'sharedmobility_span_seconds_count{{span="{name}"}} {stats["count"]}')
+            lines.append(f'sharedmobility_span_seconds_sum{{span="{name}"}} {stats["sum"]}')
+        lines += [
+            "# TYPE sharedmobility_span_bytes counter",
+            "# UNIT sharedmobility_span_bytes bytes",
+            "# HELP sharedmobility_span_bytes Payload bytes produced by the traced steps.",
+        ]
+        for name, stats in sorted(snapshot.items()):
+            if stats["bytes"]:
+                lines.append(f'sharedmobility_span_bytes_total{{span="{name}"}} {stats["bytes"]}')
+        return "\n".join(lines) + "\n" + extra + "# EOF\n"
+
+
+stats = SpanStats()
+
+
+def begin_trace(name):
+    """
+    Starts a new trace for the rest of the current context, e.g. at the top
+    of a Streamlit script, and returns it.
+    """
+    trace = Trace(name)
+    _current_trace.set(trace)
+    return trace
+
+
+@contextmanager
+def start_trace(name):
+    """
+    Collects the spans started in this context, e.g. during one rerun.
+    """
+    trace = Trace(name)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def current_span():
+    return _current_span.get()
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Times the enclosed block. The span is added to the current trace, to the
+    process-wide `stats` and, with SHAREDMOBILITY_TRACE_LOG, logged.
+    """
+    current = Span(name, attributes, _current_span.get())
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.start
+        _current_span.reset(token)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(current)
+        stats.record(current)
+        if TRACE_LOG:
+            logger.info(json.dumps(current.to_dict(), default=str))
+
+
+def traced(name):
+    """
+    Decorator running the function in a span called `name`.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
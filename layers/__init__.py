@@ -0,0 +1,8 @@
+from layers.markers import station_markers
+from layers.static import (
+    static_layer,
+    round_coordinates,
+    level_for_zoom,
+    MultiResolutionLayer,
+)
+from layers.tiles import TileRenderer, TileServer, tile_renderer, tiles_enabled
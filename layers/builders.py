@@ -0,0 +1,309 @@
+import functools
+import numpy as np
+from data.availability import AvailabilityCube
+from data.coverage import CoverageIndex
+from data.spatial import StationIndex, ProximityIndex
+from data.tracing import span
+from layers.static import static_layer, MultiResolutionLayer
+
+DISTRICT_COLUMNS = [
+    "district_name",
+    "station_count",
+    "total",
+    "z0_19",
+    "z20_64",
+    "u65",
+    "auslaender",
+    "diche_per_ha",
+]
+
+# the density categories of the "Bevölkerungsdichte" layer and their columns
+DENSITY_COLUMNS = {
+    "Gesamt": "total",
+    "0-19": "z0_19",
+    "20-64": "z20_64",
+    "65+": "u65",
+    "Ausländer": "auslaender",
+    "Bevölkerungsdichte": "diche_per_ha",
+}
+
+
+class LayerResult:
+    """
+    What a layer builder returns, independent of how it is displayed.
+
+    Attributes:
+    payload: The data the map layer is drawn from, e.g. GeoJSON.
+    metrics (dict): The numbers shown next to the layer.
+    """
+
+    def __init__(self, payload, metrics=None):
+        self.payload = payload
+        self.metrics = metrics or {}
+
+    def __getitem__(self, name):
+        return self.metrics[name]
+
+
+def layer(name):
+    """
+    Decorator timing a builder in the span `layer.<name>`, with the size of
+    string payloads.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(f"layer.{name}") as current:
+                result = func(*args, **kwargs)
+                if isinstance(result.payload, str):
+                    current.set(bytes=len(result.payload))
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+# the expensive parts are built once per DatasetStore and shared by the builders
+def station_index(store):
+    return store.derived(
+        "station_index", lambda store: StationIndex(store["unique_stations"].swiss)
+    )
+
+
+def water_proximity(store):
+    return store.derived(
+        "water_proximity",
+        lambda store: ProximityIndex(
+            store["unique_stations"].swiss, store["lakes_and_rivers"].swiss
+        ),
+    )
+
+
+def coverage_index(store):
+    return store.derived(
+        "coverage",
+        lambda store: CoverageIndex(
+            store["unique_stations"].swiss,
+            store["city_boundary"].swiss.geometry.iloc[0],
+        ),
+    )
+
+
+def availability_cube(store):
+    return store.derived(
+        "availability",
+        lambda store: AvailabilityCube(
+            store["districts_and_stations"].swiss, store["stations_and_bikes"].swiss
+        ),
+    )
+
+
+def _static(store, name, build):
+    return store.derived(f"layer:{name}", build)
+
+
+def city_area(store):
+    # in km^2, rounded like it is displayed
+    return round(store["city_boundary"].swiss.geometry.area.iloc[0] / 10**6, 2)
+
+
+@layer("overview")
+def overview(store):
+    """
+    The general key figures shown above the map.
+    """
+    districts = store["districts_and_stations"].swiss
+    water = store["lakes_and_rivers"].swiss
+    rivers = water["type"] == "river"
+    return LayerResult(
+        None,
+        {
+            "population": int(districts["total"].sum()),
+            "city_area": city_area(store),
+            "river_length": round(water.loc[rivers, "geometry"].length.sum() / 1000, 2),
+            "station_count": len(store["unique_stations"]),
+            "district_count": len(store["districts_and_stations"]),
+        },
+    )
+
+
+@layer("city_boundary")
+def city_boundary(store):
+    payload = _static(
+        store, "city_boundary", lambda store: static_layer(store["city_boundary"].wgs84)
+    )
+    length = store["city_boundary"].swiss.geometry.length.sum()
+    return LayerResult(payload, {"length": round(length / 1000, 2)})
+
+
+@layer("canton_boundary")
+def canton_boundary(store, zoom):
+    layer = _static(
+        store,
+        "canton_boundary",
+        # the canton comes in full resolution, one simplified payload per zoom band
+        lambda store: MultiResolutionLayer(store["canton_boundary"].swiss),
+    )
+    return LayerResult(layer.for_zoom(zoom))
+
+
+@layer("stations")
+def stations(store):
+    """
+    Payload: the station latitudes and longitudes as numpy arrays.
+    """
+    gdf = store["unique_stations"].swiss
+    return LayerResult(
+        (gdf["lat"].to_numpy(), gdf["lon"].to_numpy()), {"count": gdf.shape[0]}
+    )
+
+
+@layer("coverage")
+def coverage(store, radius):
+    """
+    The area within `radius` meters of any station, clipped to the city.
+    """
+    result = coverage_index(store).get(radius)
+    area = round(result.area / 10**6, 2)
+    return LayerResult(
+        result.geojson,
+        {"area": area, "share": round(area / city_area(store) * 100, 2)},
+    )
+
+
+@layer("nearest_stations")
+def nearest_stations(store, lon, lat, k=3):
+    """
+    Payload: DataFrame of the k nearest stations to a WGS84 location with
+    their `lat`, `lon`, `name` and `distance` in meters, nearest first.
+    """
+    df = station_index(store).nearest(lon, lat, k=k)
+    return LayerResult(
+        df, {"name": df.iloc[0]["name"], "distance": round(df.iloc[0]["distance"], 2)}
+    )
+
+
+@layer("districts")
+def districts(store):
+    """
+    The districts with the station count and population columns.
+    """
+    payload = _static(
+        store,
+        "districts",
+        lambda store: static_layer(store["districts_and_stations"].wgs84, DISTRICT_COLUMNS),
+    )
+    df = store["districts_and_stations"].swiss
+    return LayerResult(
+        payload,
+        {
+            "count": df.shape[0],
+            "min": df["station_count"].min(),
+            "max": df["station_count"].max(),
+        },
+    )
+
+
+@layer("water")
+def water(store, zoom):
+    """
+    The lakes and rivers clipped to the canton, simplified for `zoom`.
+    """
+    layer = _static(
+        store,
+        "water",
+        lambda store: MultiResolutionLayer(
+            store["lakes_and_rivers"].swiss,
+            ["type", "GROSSERFLU"],
+            clip_to=store["canton_boundary"].swiss.geometry,
+        ),
+    )
+    df = store["lakes_and_rivers"].swiss
+    rivers = df[df["type"] == "river"]
+    return LayerResult(
+        layer.for_zoom(zoom),
+        {
+            "river_length": round(rivers["geometry"].length.sum() / 1000, 2),
+            "names": df["GROSSERFLU"].unique().tolist(),
+        },
+    )
+
+
+@layer("stations_near_water")
+def stations_near_water(store, max_distance):
+    """
+    The stations at most `max_distance` meters from a lake or river.
+    """
+    positions = water_proximity(store).positions_within(max_distance)
+    close_stations = store["unique_stations"].wgs84.iloc[positions][["geometry"]]
+    return LayerResult(close_stations.__geo_interface__, {"count": close_stations.shape[0]})
+
+
+@layer("density")
+def density(store, category):
+    """
+    The districts colored by one of the `DENSITY_COLUMNS` categories.
+    """
+    column = DENSITY_COLUMNS[category]
+    values = store["districts_and_stations"].swiss[column]
+    return LayerResult(
+        districts(store).payload,
+        {
+            "column": column,
+            "min": values.min(),
+            "max": values.max(),
+            "mean": round(values.mean(), 2),
+        },
+    )
+
+
+def _districts_per_station(store):
+    def build(store):
+        gdf = store["districts_and_stations"].wgs84
+        return gdf.assign(
+            station_per_total=np.where(
+                gdf["station_count"] == 0, 0, gdf["total"] / gdf["station_count"]
+            )
+        )
+
+    return store.derived("districts_per_station", build)
+
+
+@layer("residents_per_station")
+def residents_per_station(store):
+    """
+    The districts with the number of residents per station.
+    """
+    payload = _static(
+        store,
+        "districts_per_station",
+        lambda store: static_layer(
+            _districts_per_station(store), ["district_name", "station_per_total"]
+        ),
+    )
+    values = _districts_per_station(store)["station_per_total"]
+    return LayerResult(
+        payload,
+        {"min": values.min(), "max": values.max(), "mean": round(values.mean(), 2)},
+    )
+
+
+@layer("availability")
+def availability(store, hour):
+    """
+    The average available bikes per district at `hour`. `hourly` is the
+    daily profile over all districts.
+    """
+    cube = availability_cube(store)
+    df_hour = cube.hour_frame(hour, store["districts_and_stations"].wgs84)
+    return LayerResult(
+        df_hour.__geo_interface__,
+        {
+            "min": df_hour["avg_num_bikes_available"].min(),
+            "max": df_hour["avg_num_bikes_available"].max(),
+            "overall": round(cube.overall(hour), 2),
+            "hourly": cube.hourly(),
+        },
+    )
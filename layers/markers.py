@@ -0,0 +1,61 @@
+import json
+import numpy as np
+from folium.plugins import FastMarkerCluster
+from folium.utilities import image_to_url
+
+STATION_ICON = "data/images/nextbike_icon_blue.png"
+
+# markers are clustered below this zoom level only, the map starts at 14
+STATION_CLUSTER_DISABLE_ZOOM = 14
+
+# the icon is created once and shared by all markers of the layer
+_MARKER_CALLBACK = """(function () {
+    var icon = L.icon({iconUrl: %s, iconSize: %s});
+    return function (row) {
+        return L.marker(new L.LatLng(row[0], row[1]), {icon: icon});
+    };
+})()"""
+
+
+def station_markers(
+    lat,
+    lon,
+    icon=STATION_ICON,
+    icon_size=(40, 40),
+    disable_clustering_at_zoom=STATION_CLUSTER_DISABLE_ZOOM,
+    name=None,
+):
+    """
+    Creates one marker layer for many stations.
+
+    The coordinates are embedded as a single array and the markers are created
+    in the browser with one shared icon, instead of one folium.Marker with its
+    own copy of the icon per station. The markers are clustered client-side
+    when zoomed out.
+
+    Returns:
+    FastMarkerCluster: The layer, to be added to the map.
+
+    Args:
+    lat (array): Latitudes of the stations.
+    lon (array): Longitudes of the stations.
+    icon (str): Path or URL of the marker image.
+    icon_size (tuple): Width and height of the marker in pixels.
+    disable_clustering_at_zoom (int): Zoom level from which every station is
+        shown on its own, None clusters at every zoom level.
+    name (str): Name of the layer in the layer control.
+    """
+    coordinates = np.column_stack(
+        [np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)]
+    )
+    callback = _MARKER_CALLBACK % (
+        json.dumps(image_to_url(icon)),
+        json.dumps(list(icon_size)),
+    )
+    options = {}
+    if disable_clustering_at_zoom is not None:
+        options["disableClusteringAtZoom"] = disable_clustering_at_zoom
+
+    return FastMarkerCluster(
+        coordinates.tolist(), callback=callback, name=name, options=options
+    )
@@ -0,0 +1,108 @@
+import threading
+import geopandas as gpd
+import numpy as np
+import shapely
+from data.crs import EPSG_GLOBAL, EPSG_SWISS
+
+# decimals kept of WGS84 coordinates, 6 decimals are about 0.1 meters
+GEOJSON_PRECISION = 6
+
+
+def round_coordinates(geometries, precision=GEOJSON_PRECISION):
+    return shapely.transform(
+        np.asarray(geometries), lambda coords: np.round(coords, precision)
+    )
+
+
+def static_layer(gdf, columns=(), clip_to=None, precision=GEOJSON_PRECISION):
+    """
+    Serializes a layer that does not change between reruns to WGS84 GeoJSON.
+
+    The result is meant to be built once and cached, so reruns skip the
+    reprojection, clipping and JSON encoding.
+
+    Returns:
+    str: The GeoJSON FeatureCollection.
+
+    Args:
+    gdf (GeoDataFrame): The layer in any CRS.
+    columns (list): Attribute columns kept as feature properties, e.g. for
+        tooltips. All other columns are dropped to keep the payload small.
+    clip_to (GeoSeries or GeoDataFrame): Optional mask the layer is clipped to.
+    precision (int): Decimals kept of the WGS84 coordinates.
+    """
+    gdf = gdf[list(columns) + [gdf.geometry.name]]
+    if clip_to is not None:
+        gdf = gpd.clip(gdf, clip_to)
+    gdf = gdf.to_crs(crs=EPSG_GLOBAL)
+    gdf[gdf.geometry.name] = round_coordinates(gdf.geometry.values, precision)
+    return gdf.to_json(drop_id=True)
+
+
+# simplification tolerance in meters per zoom band, as (highest zoom, tolerance)
+# from coarse to fine, about half a pixel at the highest zoom of each band
+ZOOM_TOLERANCES = (
+    (9, 100.0),
+    (11, 25.0),
+    (13, 6.0),
+    (15, 1.5),
+    (None, 0.0),
+)
+
+
+def level_for_zoom(zoom, zoom_tolerances=ZOOM_TOLERANCES):
+    """
+    Returns the position in `zoom_tolerances` of the band containing `zoom`.
+    """
+    for level, (max_zoom, _) in enumerate(zoom_tolerances):
+        if max_zoom is None or zoom <= max_zoom:
+            return level
+    return len(zoom_tolerances) - 1
+
+
+class MultiResolutionLayer:
+    """
+    Static layer with one simplified GeoJSON payload per zoom band.
+
+    The geometries are simplified in the swiss CRS with a topology preserving
+    tolerance in meters, then serialized like `static_layer`. Each level is
+    built on first use and kept.
+
+    Args:
+    gdf (GeoDataFrame): The layer, reprojected to the swiss CRS if needed.
+    columns (list): Attribute columns kept as feature properties.
+    clip_to (GeoSeries or GeoDataFrame): Optional mask the layer is clipped to.
+    zoom_tolerances (tuple): Zoom bands, see `ZOOM_TOLERANCES`.
+    """
+
+    def __init__(
+        self, gdf, columns=(), clip_to=None, zoom_tolerances=ZOOM_TOLERANCES
+    ):
+        if gdf.crs is not None and gdf.crs != EPSG_SWISS:
+            gdf = gdf.to_crs(crs=EPSG_SWISS)
+        gdf = gdf[list(columns) + [gdf.geometry.name]]
+        if clip_to is not None:
+            gdf = gpd.clip(gdf, clip_to)
+        self.gdf = gdf
+        self.columns = list(columns)
+        self.zoom_tolerances = zoom_tolerances
+        self._levels = {}
+        self._lock = threading.Lock()
+
+    def level(self, level):
+        payload = self._levels.get(level)
+        if payload is None:
+            with self._lock:
+                payload = self._levels.get(level)
+                if payload is None:
+                    _, tolerance = self.zoom_tolerances[level]
+                    gdf = self.gdf
+                    if tolerance:
+                        gdf = gdf.set_geometry(
+                            gdf.geometry.simplify(tolerance, preserve_topology=True)
+                        )
+                    payload = self._levels[level] = static_layer(gdf, self.columns)
+        return payload
+
+    def for_zoom(self, zoom):
+        return self.level(level_for_zoom(zoom, self.zoom_tolerances))
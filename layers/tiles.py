@@ -0,0 +1,326 @@
+import io
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import branca.colormap as cm
+import geopandas as gpd
+import numpy as np
+import shapely
+from PIL import Image, ImageDraw
+from data.tracing import span
+
+# port of the tile server, 0 keeps it off and the layers are embedded as GeoJSON
+TILE_PORT = int(os.environ.get("SHAREDMOBILITY_TILE_PORT", 0))
+
+# base url the browser loads the tiles from, e.g. a CDN or reverse proxy in
+# front of the server. required with a port, localhost is not reachable from
+# the browser of a deployed app
+TILE_URL = os.environ.get("SHAREDMOBILITY_TILE_URL", "").rstrip("/")
+
+# interface the tile server listens on
+TILE_HOST = os.environ.get("SHAREDMOBILITY_TILE_HOST", "0.0.0.0")
+
+# rendered tiles kept in memory, about 2-20 KB each
+TILE_CACHE_SIZE = int(os.environ.get("SHAREDMOBILITY_TILE_CACHE_SIZE", 4096))
+
+# seconds browsers and CDNs may cache a tile, the url changes with the data
+TILE_MAX_AGE = int(os.environ.get("SHAREDMOBILITY_TILE_MAX_AGE", 24 * 60 * 60))
+
+TILE_SIZE = 256
+MAX_ZOOM = 20
+EPSG_WEB_MERCATOR = "EPSG:3857"
+
+# half the side of the web mercator square in meters
+ORIGIN = 20037508.342789244
+
+TILE_PATH = re.compile(r"^/(\w+)/(\d+)/(\d+)/(\d+)/(\d+)\.png$")
+
+logger = logging.getLogger(__name__)
+
+
+def tiles_enabled(port=TILE_PORT, url=TILE_URL):
+    """
+    Returns True if the tile server is configured with a port and the url
+    the browser reaches it at. A port without url is ignored with a warning
+    and the layers are embedded as GeoJSON.
+    """
+    if port and not url:
+        logger.warning(
+            "SHAREDMOBILITY_TILE_PORT is set without SHAREDMOBILITY_TILE_URL, "
+            "the layers are embedded as GeoJSON."
+        )
+    return bool(port and url)
+
+
+def tile_bounds(z, x, y):
+    """
+    Returns the (minx, miny, maxx, maxy) of a XYZ tile in web mercator meters.
+    """
+    size = 2 * ORIGIN / 2**z
+    minx = -ORIGIN + x * size
+    maxy = ORIGIN - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def encode_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+EMPTY_TILE = encode_png(Image.new("RGBA", (TILE_SIZE, TILE_SIZE), (0, 0, 0, 0)))
+
+
+class TileRenderer:
+    """
+    Draws one layer as transparent PNG tiles.
+
+    The geometries are reprojected to web mercator and indexed once, a
+    tile only clips, simplifies and draws the features it intersects.
+
+    Args:
+    gdf (GeoDataFrame): The layer in any CRS.
+    stroke (tuple): RGBA of lines, outlines and point borders, None for none.
+    width (int): Line width in pixels.
+    fill (tuple): RGBA of polygons and points, None for none.
+    fills (list): RGBA per feature instead of `fill`, e.g. of a choropleth.
+    radius (int): Radius of points in pixels.
+    """
+
+    def __init__(self, gdf, stroke=None, width=1, fill=None, fills=None, radius=4):
+        self.geometries = np.asarray(gdf.geometry.to_crs(EPSG_WEB_MERCATOR).array)
+        self.tree = shapely.STRtree(self.geometries)
+        self.stroke = stroke
+        self.width = width
+        self.fills = fills if fills is not None else [fill] * len(self.geometries)
+        self.radius = radius
+
+    def render(self, z, x, y):
+        """
+        Returns the tile as PNG bytes.
+        """
+        minx, miny, maxx, maxy = tile_bounds(z, x, y)
+        resolution = (maxx - minx) / TILE_SIZE
+        # features just outside still reach into the tile with their width
+        margin = (self.radius + self.width) * resolution
+        bounds = (minx - margin, miny - margin, maxx + margin, maxy + margin)
+        hits = self.tree.query(shapely.box(*bounds), predicate="intersects")
+        if len(hits) == 0:
+            return EMPTY_TILE
+
+        geometries = shapely.clip_by_rect(self.geometries[hits], *bounds)
+        geometries = shapely.simplify(geometries, resolution / 2)
+        # to pixels, y grows downwards
+        geometries = shapely.transform(
+            geometries, lambda coords: (coords - [minx, maxy]) / [resolution, -resolution]
+        )
+
+        image = Image.new("RGBA", (TILE_SIZE, TILE_SIZE), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(image, "RGBA")
+        for position, geometry in zip(hits, geometries):
+            fill = self.fills[position]
+            for part in shapely.get_parts(geometry):
+                self._draw(image, draw, part, fill)
+        return encode_png(image)
+
+    def _draw(self, image, draw, geometry, fill):
+        kind = geometry.geom_type
+        if kind == "Point":
+            x, y = geometry.x, geometry.y
+            r = self.radius
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=fill, outline=self.stroke)
+        elif kind in ("LineString", "LinearRing"):
+            if self.stroke is not None:
+                draw.line(list(geometry.coords), fill=self.stroke, width=self.width, joint="curve")
+        elif kind == "Polygon":
+            rings = [geometry.exterior, *geometry.interiors]
+            if fill is not None:
+                if len(rings) == 1:
+                    draw.polygon(list(geometry.exterior.coords), fill=fill)
+                else:
+                    # holes are cut out of a separate layer, then blended
+                    overlay = Image.new("RGBA", image.size, (0, 0, 0, 0))
+                    overlay_draw = ImageDraw.Draw(overlay)
+                    overlay_draw.polygon(list(geometry.exterior.coords), fill=fill)
+                    for ring in geometry.interiors:
+                        overlay_draw.polygon(list(ring.coords), fill=(0, 0, 0, 0))
+                    image.alpha_composite(overlay)
+            if self.stroke is not None:
+                for ring in rings:
+                    draw.line(list(ring.coords), fill=self.stroke, width=self.width)
+        elif kind == "GeometryCollection":
+            for part in geometry.geoms:
+                self._draw(image, draw, part, fill)
+
+
+def rgba(color, opacity=1.0):
+    # "#rrggbb" or an (r, g, b, a) byte tuple with the alpha replaced
+    if isinstance(color, str):
+        color = tuple(int(color[i : i + 2], 16) for i in (1, 3, 5))
+    return (*color[:3], round(opacity * 255))
+
+
+def station_tiles(store):
+    return TileRenderer(
+        store["unique_stations"].wgs84, stroke=rgba("#ffffff"), fill=rgba("#0065b3"), radius=5
+    )
+
+
+def district_tiles(store):
+    # colored by the station count like the GeoJSON layer of the app
+    gdf = store["districts_and_stations"].wgs84
+    values = gdf["station_count"].astype(float)
+    colormap = cm.linear.YlGnBu_09.scale(values.min(), values.max())
+    fills = [rgba(colormap.rgba_bytes_tuple(value), 0.7) for value in values]
+    return TileRenderer(gdf, stroke=rgba("#000000"), width=1, fills=fills)
+
+
+def water_tiles(store):
+    # only the part within the canton, like the GeoJSON layer of the app
+    gdf = gpd.clip(store["lakes_and_rivers"].wgs84, store["canton_boundary"].wgs84)
+    # leaflet fills polygons with the line color at 0.2 opacity by default
+    return TileRenderer(
+        gdf, stroke=rgba("#0000ff", 0.4), width=8, fill=rgba("#0000ff", 0.2)
+    )
+
+
+# the tiled layers by name and how their renderer is built from the store
+TILE_LAYERS = {
+    "stations": station_tiles,
+    "districts": district_tiles,
+    "water": water_tiles,
+}
+
+
+def tile_renderer(store, name):
+    """
+    Returns the TileRenderer of a `TILE_LAYERS` layer, built once per store.
+    """
+    return store.derived(f"tiles:{name}", TILE_LAYERS[name])
+
+
+def tile_version(store):
+    # part of the tile urls, a reloaded store gets new urls and fresh caches
+    return int(store.loaded_at)
+
+
+class TileCache:
+    """
+    The most recently used rendered tiles, up to `size` of them.
+    """
+
+    def __init__(self, size=TILE_CACHE_SIZE):
+        self.size = size
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+            return tile
+
+    def put(self, key, tile):
+        with self._lock:
+            self._tiles[key] = tile
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > self.size:
+                self._tiles.popitem(last=False)
+
+    def __len__(self):
+        return len(self._tiles)
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        match = TILE_PATH.match(self.path.split("?")[0])
+        if match is None:
+            self.send_error(404)
+            return
+        name = match.group(1)
+        version, z, x, y = (int(value) for value in match.groups()[1:])
+        if name not in TILE_LAYERS or z > MAX_ZOOM or x >= 2**z or y >= 2**z:
+            self.send_error(404)
+            return
+
+        try:
+            tile, current = self.server.tiles.tile(name, z, x, y)
+        except Exception:
+            # e.g. while the datasets are reloaded, the browser retries the tile later
+            logger.exception("Rendering the tile %s failed", self.path)
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(tile)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        if version == current:
+            # the url changes with the data, so the tile never changes
+            self.send_header("Cache-Control", f"public, max-age={TILE_MAX_AGE}, immutable")
+        else:
+            self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(tile)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TileServer:
+    """
+    Serves the `TILE_LAYERS` of the current datasets as PNG tiles under
+    `/<layer>/<version>/<z>/<x>/<y>.png` from a background thread.
+
+    Args:
+    get_store (callable): Returns the current DatasetStore, e.g.
+        `DatasetRegistry.get`.
+    host (str): Interface to listen on.
+    port (int): Port to listen on.
+    cache_size (int): Number of rendered tiles kept in memory.
+    """
+
+    def __init__(self, get_store, host=TILE_HOST, port=TILE_PORT, cache_size=TILE_CACHE_SIZE):
+        self.get_store = get_store
+        self.host = host
+        self.port = port
+        self.cache = TileCache(cache_size)
+        self._server = None
+
+    def tile(self, name, z, x, y):
+        """
+        Returns the PNG bytes of a tile and the version of the store it was
+        drawn from.
+        """
+        store = self.get_store()
+        version = tile_version(store)
+        key = (name, version, z, x, y)
+        tile = self.cache.get(key)
+        if tile is None:
+            with span(f"tile.{name}", zoom=z) as current:
+                tile = tile_renderer(store, name).render(z, x, y)
+                current.set(bytes=len(tile))
+            self.cache.put(key, tile)
+        return tile, version
+
+    def url(self, name, store, base_url=TILE_URL):
+        """
+        Returns the tile url template of a layer for `folium.TileLayer`.
+        """
+        return f"{base_url}/{name}/{tile_version(store)}/{{z}}/{{x}}/{{y}}.png"
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), _TileHandler)
+        self._server.daemon_threads = True
+        self._server.tiles = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
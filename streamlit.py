@@ -1,15 +1,19 @@
+import os
 import streamlit as st
-from data import sharedmobility
+import pandas as pd
+from data import sharedmobility_batch
+from data.costs import costs
+from data.tracing import begin_trace, span, stats
+from data.live import LiveBikes, live_feed
+from layers import builders, level_for_zoom, station_markers, TileServer, tiles_enabled
+from data.store import DatasetRegistry
+from data.crs import EPSG_GLOBAL, convert_to_global_crs
 from streamlit_folium import st_folium
 import folium
-import geopandas as gpd
-from shapely.geometry import Point, mapping
-from shapely.ops import nearest_points
+from shapely.geometry import mapping
 from streamlit_js_eval import get_geolocation
 from folium.features import GeoJsonPopup, GeoJsonTooltip, CustomIcon
 import branca.colormap as cm
-import numpy as np
-import pandas as pd
 
 # Set page config
 st.set_page_config(
@@ -24,6 +28,14 @@ st.set_page_config(
     },
 )
 
+# spans of this rerun, shown in the debug panel at the end
+trace = begin_trace("rerun")
+
+# the timing panel is shown with SHAREDMOBILITY_DEBUG=1 or ?debug=1 in the url
+debug = os.environ.get("SHAREDMOBILITY_DEBUG", "") not in ("", "0", "false") or (
+    st.query_params.get("debug") == "1"
+)
+
 # make h4 titel center
 title_alignment = """
 <style>
@@ -42,9 +54,6 @@ if "location" not in st.session_state:
 if "last_clicked" not in st.session_state:
     st.session_state["last_clicked"] = None
 
-# if "zoom" not in st.session_state:
-#     st.session_state["zoom"] = 15
-
 # create description
 st.sidebar.markdown(
     """
@@ -56,21 +65,6 @@ st.sidebar.markdown(
 
 st.sidebar.divider()
 
-# load data and transform
-EPSG_GLOBAL = "EPSG:4326"
-# EPSG_SWISS = "EPSG:21781" #old swiss crs
-EPSG_SWISS = "EPSG:2056"  # new swiss crs
-
-
-# convert to swiss crs
-def convert_to_swiss_crs(gdf):
-    return gdf.to_crs(crs=EPSG_SWISS)
-
-
-# convert to global crs
-def convert_to_global_crs(gdf):
-    return gdf.to_crs(crs=EPSG_GLOBAL)
-
 
 # create feature collection
 def create_feature_collection(data):
@@ -89,57 +83,85 @@ def create_feature_collection(data):
     return feature_collection
 
 
-# load data and cache it using streamlit cache function
-@st.cache_data
-def load_data():
-    gdf_city_boundary = sharedmobility("city_boundary")  # SMALL - NO VIEW
+# seconds to wait for each dataset before the load is reported as failed
+LOAD_TIMEOUT = 120
+
+
+def load_datasets():
+    # all queries run concurrently, the cold start costs about the slowest one
+    datasets = sharedmobility_batch(
+        [
+            "city_boundary",  # SMALL - NO VIEW
+            "districts_and_stations",  # VIEW
+            "lakes_and_rivers",  # VIEW
+            "unique_stations",  # VIEW but not optimized
+            "canton_boundary",  # SMALL - NO VIEW
+            "stations_and_bikes",  # VIEW
+        ],
+        timeout=LOAD_TIMEOUT,
+    ).raise_for_errors()
+
+    gdf_city_boundary = datasets["city_boundary"]
     gdf_city_boundary = gdf_city_boundary.set_crs(crs=EPSG_GLOBAL)
 
-    gdf_districts_and_stations = sharedmobility("districts_and_stations")  # VIEW
+    gdf_districts_and_stations = datasets["districts_and_stations"]
     gdf_districts_and_stations = gdf_districts_and_stations.set_crs(crs=EPSG_GLOBAL)
 
-    gdf_lakes_and_rivers = sharedmobility("lakes_and_rivers")  # VIEW
+    gdf_lakes_and_rivers = datasets["lakes_and_rivers"]
     gdf_lakes_and_rivers = gdf_lakes_and_rivers.set_crs(crs=EPSG_GLOBAL)
 
-    gdf_unique_stations = sharedmobility("unique_stations")  # VIEW but not optimized
-    gdf_unique_stations["geometry"] = [
-        Point(lon, lat)
-        for lon, lat in zip(gdf_unique_stations["lon"], gdf_unique_stations["lat"])
-    ]
-    gdf_unique_stations = gpd.GeoDataFrame(gdf_unique_stations, geometry="geometry")
-    gdf_unique_stations = gdf_unique_stations.set_crs(crs=EPSG_GLOBAL)
+    # the station points are already built from lat/lon by the data layer
+    gdf_unique_stations = datasets["unique_stations"]
 
-    gdf_canton_boundary = sharedmobility("canton_boundary")  # SMALL - NO VIEW
+    gdf_canton_boundary = datasets["canton_boundary"]
     gdf_canton_boundary = gdf_canton_boundary.set_crs(crs=EPSG_GLOBAL)
 
-    gdf_stations_and_bikes = sharedmobility("stations_and_bikes")  # VIEW
+    gdf_stations_and_bikes = datasets["stations_and_bikes"]
     gdf_stations_and_bikes = gdf_stations_and_bikes.set_crs(crs=EPSG_GLOBAL)
 
-    gdf_city_boundary = convert_to_swiss_crs(gdf_city_boundary)
-    gdf_unique_stations = convert_to_swiss_crs(gdf_unique_stations)
-    gdf_canton_boundary = convert_to_swiss_crs(gdf_canton_boundary)
-    gdf_districts_and_stations = convert_to_swiss_crs(gdf_districts_and_stations)
-    gdf_lakes_and_rivers = convert_to_swiss_crs(gdf_lakes_and_rivers)
-    gdf_stations_and_bikes = convert_to_swiss_crs(gdf_stations_and_bikes)
-
-    return (
-        gdf_unique_stations,
-        gdf_city_boundary,
-        gdf_districts_and_stations,
-        gdf_lakes_and_rivers,
-        gdf_stations_and_bikes,
-        gdf_canton_boundary,
-    )
+    return {
+        "unique_stations": gdf_unique_stations,
+        "city_boundary": gdf_city_boundary,
+        "districts_and_stations": gdf_districts_and_stations,
+        "lakes_and_rivers": gdf_lakes_and_rivers,
+        "stations_and_bikes": gdf_stations_and_bikes,
+        "canton_boundary": gdf_canton_boundary,
+    }
+
+
+# one registry per process, all sessions share the same read-only store
+@st.cache_resource
+def load_registry():
+    return DatasetRegistry(load_datasets)
+
+
+def load_data():
+    # every layer is held in both crs, the swiss one is built once on first use.
+    # an expired store is still served while the new one loads in the background
+    return load_registry().get()
+
+
+# the analysis lives in layers.builders, this script only displays the results
+with span("load_data"):
+    store = load_data()
+
+
+# with SHAREDMOBILITY_TILE_PORT and _URL the stations, districts and water are served
+# as png tiles by one server thread per process instead of being embedded as geojson
+@st.cache_resource
+def load_tile_server():
+    if not tiles_enabled():
+        return None
+    return TileServer(load_registry().get).start()
 
 
-(
-    gdf_unique_stations,
-    gdf_city_boundary,
-    gdf_districts_and_stations,
-    gdf_lakes_and_rivers,
-    gdf_stations_and_bikes,
-    gdf_canton_boundary,
-) = load_data()
+tile_server = load_tile_server()
+
+
+# free bike positions shared by all sessions, polled in the background
+@st.cache_resource
+def load_live_bikes():
+    return LiveBikes(live_feed()).start()
 
 
 # create title
@@ -169,6 +191,7 @@ selected = st.multiselect(
         "Bevölkerungsdichte",
         "Bevölkerungsdichte-Stationen",
         "Verfügbarkeit-Fahrräder",
+        "Fahrräder-Live",
     ],
     default=["Gewässer", "Stadtgrenze", "Kantonsgrenze", "Stationen"],
     label_visibility="hidden",
@@ -180,48 +203,59 @@ st.divider()
 st.subheader("Allgemeine Kennzahlen zu den Daten")
 col1, col2, col3, col4, col5 = st.columns(5)
 
+overview = builders.overview(store)
+square_kilometers = overview["city_area"]
+
 # calculate population
 with col1:
-    population = int(gdf_districts_and_stations["total"].sum())
-    st.metric("Bevölkerung (Stadt Luzern)", population)
+    st.metric("Bevölkerung (Stadt Luzern)", overview["population"])
 
 # calculate city size
 with col2:
-    gdf_city_boundary["area"] = gdf_city_boundary["geometry"].area
-    square_kilometers = round(gdf_city_boundary["area"].iloc[0] / 10**6, 2)
     st.metric("Stadtgrösse (in km^2)", square_kilometers)
 
 # calculate river length
 with col3:
-    df = gdf_lakes_and_rivers[gdf_lakes_and_rivers["type"] == "river"].copy()
-    df["length"] = df["geometry"].length
-    river_length = round(df["length"].sum() / 1000, 2)
-    st.metric("Flusslänge (in km) (Kt. LU)", river_length)
+    st.metric("Flusslänge (in km) (Kt. LU)", overview["river_length"])
 
 # count stations
 with col4:
-    st.metric("Anzahl Stationen", gdf_unique_stations.shape[0])
+    st.metric("Anzahl Stationen", overview["station_count"])
 
 # calculate district count
 with col5:
-    st.metric("Anzahl Quartiere", gdf_districts_and_stations.shape[0])
+    st.metric("Anzahl Quartiere", overview["district_count"])
 
 ##### Create Map #####
-m = folium.Map(location=[47.05048, 8.30635], zoom_start=14)
+MAP_ZOOM_START = 14
+
+# zoom of the map in the browser, picks the level of detail of the layers.
+# st_folium rebuilds the map whenever its html changes, so the zoom is not
+# part of it: it is passed to st_folium separately, and the layers only
+# change when the zoom crosses into another level of detail
+zoom = st.session_state.get("zoom", MAP_ZOOM_START)
+m = folium.Map(location=[47.05048, 8.30635], zoom_start=MAP_ZOOM_START)
+
+
+# only the visible tiles are loaded by the browser and they are cached there
+def add_tile_layer(name, title):
+    folium.TileLayer(
+        tiles=tile_server.url(name, store),
+        attr="Nextbike Luzern",
+        name=title,
+        overlay=True,
+        max_zoom=20,
+    ).add_to(m)
 
 # add city boundary to map
 if "Stadtgrenze" in selected:
-    df = gdf_city_boundary.copy()
-    length = df["geometry"].length.sum()
-    feature_collection = gpd.GeoSeries(
-        df.to_crs(crs=EPSG_GLOBAL)["geometry"]
-    ).__geo_interface__
+    layer = builders.city_boundary(store)
     folium.GeoJson(
-        feature_collection,
+        layer.payload,
         style_function=lambda x: {"color": "darkblue", "opacity": 0.8},
     ).add_to(m)
 
-    city_length = round(length / 1000, 2)
+    city_length = layer["length"]
     st.sidebar.markdown("### Stadtgrenze von Luzern")
     st.sidebar.metric("Länge der Stadtgrenze (in km)", city_length)
 
@@ -234,12 +268,8 @@ if "Stadtgrenze" in selected:
     st.sidebar.divider()
 
 if "Kantonsgrenze" in selected:
-    df = gdf_canton_boundary.copy()
-    feature_collection = gpd.GeoSeries(
-        df.to_crs(crs=EPSG_GLOBAL)["geometry"]
-    ).__geo_interface__
     folium.GeoJson(
-        feature_collection,
+        builders.canton_boundary(store, zoom).payload,
         style_function=lambda x: {"color": "darkgreen", "opacity": 0.3},
     ).add_to(m)
 
@@ -251,28 +281,24 @@ if "Kantonsgrenze" in selected:
 
 # add unique stations to map
 if "Stationen" in selected:
-    df = gdf_unique_stations.copy()
-
+    layer = builders.stations(store)
     st.sidebar.markdown("### Stationen")
-    st.sidebar.metric("Anzahl Stationen", gdf_unique_stations.shape[0])
-    df = convert_to_global_crs(df)
-    for idx, row in df.iterrows():
-        custom_icon = CustomIcon(
-            "data/images/nextbike_icon_blue.png", icon_size=(40, 40)
-        )
-        folium.Marker(
-            location=[row["lat"], row["lon"]],
-            icon=custom_icon,
-        ).add_to(m)
+    st.sidebar.metric("Anzahl Stationen", layer["count"])
+
+    if tile_server:
+        add_tile_layer("stations", "Stationen")
+    else:
+        # one clustered layer with a shared icon instead of one marker per station
+        lat, lon = layer.payload
+        station_markers(lat, lon, icon="data/images/nextbike_icon_blue.png").add_to(m)
 
     st.sidebar.write(
-        f"Die Karte zeigt {gdf_unique_stations.shape[0]} alle Nextbike Stationen in der Stadt Luzern"
+        f"Die Karte zeigt {layer['count']} alle Nextbike Stationen in der Stadt Luzern"
     )
     st.sidebar.divider()
 
 # add unique stations in circles
 if "Station-Umkreis" in selected:
-    df = gdf_unique_stations.copy()
     st.sidebar.markdown("### Station-Umkreis")
     st.sidebar.write(
         "Mit dem Radius, kannst du die Abdeckung der Stationen in der Stadt Luzern anschauen"
@@ -281,29 +307,21 @@ if "Station-Umkreis" in selected:
         "Radius in Metern", min_value=100, max_value=500, value=100, step=100
     )
 
-    df["geometry"] = df.geometry.buffer(slider_value)
-
-    # check that circle is within city boundary, else clip it to boundary
-    df["geometry"] = df.intersection(gdf_city_boundary.geometry.iloc[0])
-
-    df = df["geometry"].unary_union
+    # the clipped union of all circles is computed once per radius
+    layer = builders.coverage(store, slider_value)
 
-    total_area = round(df.area / 10**6, 2)
     st.sidebar.write(f"Stations Abdeckung bei einem Radius von {slider_value} Meter")
     col1, col2 = st.sidebar.columns(2)
 
-    col1.metric(f"in %", round(total_area / square_kilometers * 100, 2))
-    col2.metric("in km^2", total_area)
+    col1.metric(f"in %", layer["share"])
+    col2.metric("in km^2", layer["area"])
 
     st.sidebar.write(
         f"Die Stations-Abdeckung wird mit der Gesamtfläche der Stadt Luzern ({square_kilometers}km^2) verglichen"
     )
 
-    merged_gdf = gpd.GeoDataFrame(geometry=[df])
-    merged_gdf.set_crs(crs=EPSG_SWISS, inplace=True)
-    merged_geojson = convert_to_global_crs(merged_gdf).__geo_interface__
     folium.GeoJson(
-        merged_geojson,
+        layer.payload,
         style_function=lambda feature: {
             "fillColor": "#ffff00",
             "color": "black",
@@ -316,8 +334,6 @@ if "Station-Umkreis" in selected:
 
 # add nearest stations to map
 if "Nächste-Station" in selected:
-    df = gdf_unique_stations.copy()
-
     st.sidebar.markdown("### Nächste-Station")
     st.sidebar.write(
         "Wähle ein Standort auf der Karte oder lasse deinen Standort verwenden, um einen Wert auf der Karte zu verwenden, muss du die Funktion Mein Standort verwenden deaktivieren und auf der Karte eine beliebige Stelle klicken"
@@ -350,16 +366,8 @@ if "Nächste-Station" in selected:
         icon=custom_icon,
     ).add_to(m)
 
-    point_gdf = gpd.GeoDataFrame([{"id": 1, "geometry": Point(lon, lat)}])
-
-    point_gdf = point_gdf.set_crs(crs=EPSG_GLOBAL)
-    point_gdf = convert_to_swiss_crs(point_gdf)
-    df = convert_to_swiss_crs(df)
-    df["distance"] = df.distance(point_gdf.iloc[0].geometry)
-
-    df = df.sort_values("distance")
-    df = df.head(3).reset_index(drop=True)
-    df = convert_to_global_crs(df)
+    layer = builders.nearest_stations(store, lon, lat, k=3)
+    df = layer.payload
 
     green_location = [lat, lon]
 
@@ -403,16 +411,14 @@ if "Nächste-Station" in selected:
         ).add_to(m)
 
     st.sidebar.markdown(
-        f"Die nächste Station ist **{df.iloc[0]['name']}** und {round(df.iloc[0]['distance'], 2)} Meter entfernt. Die Station wird dir in Grün angezeigt."
+        f"Die nächste Station ist **{layer['name']}** und {layer['distance']} Meter entfernt. Die Station wird dir in Grün angezeigt."
     )
     st.sidebar.divider()
 
 # add districts to map
 if "Quartiere" in selected:
-    df = gdf_districts_and_stations.copy()
-    linear = cm.linear.YlGnBu_09.scale(
-        df["station_count"].min(), df["station_count"].max()
-    )
+    layer = builders.districts(store)
+    linear = cm.linear.YlGnBu_09.scale(layer["min"], layer["max"])
     m.add_child(linear)
 
     def style_function(feature):
@@ -424,46 +430,44 @@ if "Quartiere" in selected:
             "fillOpacity": 0.7,
         }
 
-    df = convert_to_global_crs(df)
-    feature_collection = df.__geo_interface__
+    feature_collection = layer.payload
 
     highlight_function = lambda x: {"weight": 3, "color": "black"}
 
     st.sidebar.markdown("### Quartiere")
-    st.sidebar.metric("Anzahl Quartiere", df.shape[0])
+    st.sidebar.metric("Anzahl Quartiere", layer["count"])
 
     st.sidebar.write(
-        f"Es gibt insgesamt {df.shape[0]} Quartiere in der Stadt Luzern, dabei haben gewisse Quartiere mehrere Stationen oder gar keine Stationen. Wenn du mit der Maus über ein Quartier fährst, siehst du die Anzahl der Stationen in diesem Quartier. Zudem ist die Farbe des Quartiers abhängig von der Anzahl der Stationen."
+        f"Es gibt insgesamt {layer['count']} Quartiere in der Stadt Luzern, dabei haben gewisse Quartiere mehrere Stationen oder gar keine Stationen. Wenn du mit der Maus über ein Quartier fährst, siehst du die Anzahl der Stationen in diesem Quartier. Zudem ist die Farbe des Quartiers abhängig von der Anzahl der Stationen."
     )
 
     # Add the GeoJSON to the map with coloring
-    folium.GeoJson(
-        feature_collection,
-        style_function=style_function,
-        highlight_function=highlight_function,
-        tooltip=GeoJsonTooltip(
-            fields=["district_name", "station_count"],
-            aliases=["District: ", "Station Count: "],
-            localize=True,
-        ),
-        popup=GeoJsonPopup(
-            fields=["district_name", "station_count"],
-            aliases=["District: ", "Station Count: "],
-        ),
-    ).add_to(m)
+    if tile_server:
+        add_tile_layer("districts", "Quartiere")
+    else:
+        folium.GeoJson(
+            feature_collection,
+            style_function=style_function,
+            highlight_function=highlight_function,
+            tooltip=GeoJsonTooltip(
+                fields=["district_name", "station_count"],
+                aliases=["District: ", "Station Count: "],
+                localize=True,
+            ),
+            popup=GeoJsonPopup(
+                fields=["district_name", "station_count"],
+                aliases=["District: ", "Station Count: "],
+            ),
+        ).add_to(m)
     st.sidebar.divider()
 
 # add lakes and rivers to map
 if "Gewässer" in selected:
-    df_rivers = gdf_lakes_and_rivers[gdf_lakes_and_rivers["type"] == "river"].copy()
-    df_canton = gdf_canton_boundary.copy()
-    df = gdf_lakes_and_rivers.copy()
-    df = gpd.clip(df, df_canton.geometry)
+    layer = builders.water(store, zoom)
 
     st.sidebar.write("### Gewässer (Reuss und Vierwaldstättersee)")
 
-    df_rivers["length"] = df_rivers["geometry"].length
-    river_length = round(df_rivers["length"].sum() / 1000, 2)
+    river_length = layer["river_length"]
 
     max_flusslänge = 164
 
@@ -478,7 +482,7 @@ if "Gewässer" in selected:
     reuss_prozent = round(reuss_länge_luzern / max_flusslänge * 100, 2)
 
     # Ausgabe der Informationen in der Sidebar
-    seen = gdf_lakes_and_rivers["GROSSERFLU"].unique().tolist()
+    seen = layer["names"]
     st.sidebar.markdown(
         "Der Kanton Luzern grenzt an die Seen und Flüsse: {}".format(", ".join(seen))
     )
@@ -490,28 +494,29 @@ if "Gewässer" in selected:
         "Es wird jeweils nur der Teil vom Gewässer angezeigt, der sich im Kanton Luzern befindet."
     )
 
-    df = convert_to_global_crs(df)
-    folium.GeoJson(
-        df.__geo_interface__,
-        style_function=lambda feature: {
-            "color": "blue",
-            "weight": 8,
-            "opacity": 0.4,
-        },
-        tooltip=folium.GeoJsonTooltip(
-            fields=["GROSSERFLU"],
-            aliases=[
-                "Name:"
-            ],  # This is what will be shown in the tooltip. Adjust the alias as necessary.
-            localize=True,
-        ),
-    ).add_to(m)
+    # the water layer is already clipped to the canton
+    if tile_server:
+        add_tile_layer("water", "Gewässer")
+    else:
+        folium.GeoJson(
+            layer.payload,
+            style_function=lambda feature: {
+                "color": "blue",
+                "weight": 8,
+                "opacity": 0.4,
+            },
+            tooltip=folium.GeoJsonTooltip(
+                fields=["GROSSERFLU"],
+                aliases=[
+                    "Name:"
+                ],  # This is what will be shown in the tooltip. Adjust the alias as necessary.
+                localize=True,
+            ),
+        ).add_to(m)
     st.sidebar.divider()
 
 # add stations close to rivers to map
 if "Station-in-Gewässer-Nähe" in selected:
-    df = gdf_unique_stations.copy()
-    df2 = gdf_lakes_and_rivers.copy()
     st.sidebar.markdown("### Gewässer")
     st.sidebar.write(
         "Die Grafik zeigt die Stationen in der Nähe von Gewässern. Mit dem Slider kannst du die Entfernung dazu einstellen"
@@ -525,44 +530,21 @@ if "Station-in-Gewässer-Nähe" in selected:
         key="slider_fluesse",
     )
 
-    def stations_close_to_water(stations, rivers_and_lakes, max_distance):
-        close_stations = []
-
-        for station in stations.geometry:
-            # Calculate the nearest point on any river or lake to the current station
-            nearest_points_list = [
-                nearest_points(station, water)[1] for water in rivers_and_lakes.geometry
-            ]
+    # Filter stations close to rivers, the distances are computed only once
+    layer = builders.stations_near_water(store, slider_value)
 
-            # Calculate the distance from the station to each nearest point on the rivers and lakes
-            distances = [station.distance(point) for point in nearest_points_list]
-
-            # Check if any of these distances are within the max_distance
-            if min(distances) <= max_distance:
-                close_stations.append(station)
-
-        # Return a new GeoDataFrame containing only the stations close to a river or lake
-        return gpd.GeoDataFrame(geometry=close_stations, crs=rivers_and_lakes.crs)
-
-    # Filter stations close to rivers
-    close_stations = stations_close_to_water(df, df2, slider_value)
-
-    st.sidebar.metric(
-        f"Anzahl Stationen in der Nähe von Wasser", close_stations.shape[0]
-    )
+    st.sidebar.metric(f"Anzahl Stationen in der Nähe von Wasser", layer["count"])
 
     st.sidebar.write(
         f"Die blauen Markierungen zeigen die Stationen in der Nähe von Wasser. Die Entfernung zum Wasser beträgt maximal {slider_value} Meter."
     )
-    close_stations = convert_to_global_crs(close_stations)
 
     folium.GeoJson(
-        close_stations.__geo_interface__,
+        layer.payload,
     ).add_to(m)
     st.sidebar.divider()
 
 if "Bevölkerungsdichte" in selected:
-    df = gdf_districts_and_stations.copy()
     st.sidebar.markdown("### Bevölkerungsdichte")
 
     st.sidebar.write(
@@ -573,14 +555,8 @@ if "Bevölkerungsdichte" in selected:
         "Bevölkerungsdichte Kategorie",
         ["Gesamt", "0-19", "20-64", "65+", "Ausländer", "Dichte pro ha"],
     )
-    category_map = {
-        "Gesamt": "total",
-        "0-19": "z0_19",
-        "20-64": "z20_64",
-        "65+": "u65",
-        "Ausländer": "auslaender",
-        "Bevölkerungsdichte": "diche_per_ha",
-    }
+    category_map = builders.DENSITY_COLUMNS
+    layer = builders.density(store, selected_density)
 
     category_map_desc = {
         "Gesamt": "%",
@@ -592,15 +568,12 @@ if "Bevölkerungsdichte" in selected:
     }
 
     # create colormap
-    linear = cm.linear.YlGnBu_09.scale(
-        df[category_map[selected_density]].min(),
-        df[category_map[selected_density]].max(),
-    )
+    linear = cm.linear.YlGnBu_09.scale(layer["min"], layer["max"])
     m.add_child(linear)
 
     def style_function(feature):
         # Use the selected_density for styling
-        station_count = feature["properties"][category_map[selected_density]]
+        station_count = feature["properties"][layer["column"]]
         return {
             "fillColor": linear(station_count),
             "color": "black",
@@ -608,10 +581,7 @@ if "Bevölkerungsdichte" in selected:
             "fillOpacity": 0.7,
         }
 
-    df = convert_to_global_crs(
-        df
-    )  # Assuming this function is defined elsewhere to convert the CRS
-    feature_collection = df.__geo_interface__
+    feature_collection = layer.payload
 
     highlight_function = lambda x: {"weight": 3, "color": "black"}
 
@@ -640,7 +610,7 @@ if "Bevölkerungsdichte" in selected:
     ).add_to(m)
 
     st.sidebar.write(
-        f"Die Karte zeigt die Bevölkerungsdichte in der Stadt Luzern. Die Farbe der Quartiere ist abhängig von der Bevölkerungsdichte in der Kategorie {selected_density}. Im Vergleich zur Gesamtbevölker in der Stadt Luzern, macht die Bevölkerung der Kategorie '{selected_density}' einen Anteil von {round(df[category_map[selected_density]].mean(), 2)}% aus."
+        f"Die Karte zeigt die Bevölkerungsdichte in der Stadt Luzern. Die Farbe der Quartiere ist abhängig von der Bevölkerungsdichte in der Kategorie {selected_density}. Im Vergleich zur Gesamtbevölker in der Stadt Luzern, macht die Bevölkerung der Kategorie '{selected_density}' einen Anteil von {layer['mean']}% aus."
     )
     st.sidebar.divider()
 
@@ -650,22 +620,11 @@ if "Bevölkerungsdichte-Stationen" in selected:
         "Die Grafik zeigt die Abhängigkeit der Stationen von der Bevölkerungsdichte, klicke auf ein Quartiere um zu sehen wie viele Stationen pro Bewohner zur Verfügung stehen."
     )
 
-    df = gdf_districts_and_stations.copy()
-    df = convert_to_global_crs(df)
-
-    df["station_per_total"] = np.where(
-        df["station_count"] == 0, 0, df["total"] / df["station_count"]
-    )
+    layer = builders.residents_per_station(store)
 
     # create colormap
-    linear = cm.linear.YlGnBu_09.scale(
-        df["station_per_total"].min(),
-        df["station_per_total"].max(),
-    )
-    st.sidebar.metric(
-        "Durchschnittliche Bewohner pro Station",
-        round(df["station_per_total"].mean(), 2),
-    )
+    linear = cm.linear.YlGnBu_09.scale(layer["min"], layer["max"])
+    st.sidebar.metric("Durchschnittliche Bewohner pro Station", layer["mean"])
 
     m.add_child(linear)
 
@@ -685,7 +644,7 @@ if "Bevölkerungsdichte-Stationen" in selected:
             "fillOpacity": 0.7,
         }
 
-    feature_collection = df.__geo_interface__
+    feature_collection = layer.payload
     highlight_function = lambda x: {"weight": 3, "color": "black"}
 
     # Adjust the tooltip to use selected_density for dynamic information display
@@ -707,9 +666,6 @@ if "Bevölkerungsdichte-Stationen" in selected:
     st.sidebar.divider()
 
 if "Verfügbarkeit-Fahrräder" in selected:
-    df = gdf_stations_and_bikes.copy()
-    df2 = gdf_districts_and_stations.copy()
-
     st.sidebar.markdown("### Verfügbarkeit-Fahrräder")
     st.sidebar.write(
         "Die Grafik zeigt die Verfügbarkeit der Fahrräder pro Quartiere, klicke auf ein Quartiere um mehr über die Verfügbarkeit zu sehen, zudem kannst du über den Regler die Uhrzeit auswählen."
@@ -718,29 +674,11 @@ if "Verfügbarkeit-Fahrräder" in selected:
     # slider for 24h
     hour_slider = st.sidebar.slider("Uhrzeit", 0, 23, 12, 1)
 
-    df = gpd.sjoin(df2, df, how="inner", predicate="contains")
-
-    # Find missing districts
-    missing_districts = df2[~df2["district_name"].isin(df["district_name"])].copy()
-    missing_districts = pd.concat(
-        [missing_districts.assign(hour_of_day=hour) for hour in range(24)],
-        ignore_index=True,
-    )
-
-    df = pd.concat([df, missing_districts], ignore_index=True).reset_index(drop=True)
-    df.fillna(0, inplace=True)
-    df = gpd.GeoDataFrame(df, geometry="geometry")
-
-    df = df[["district_name", "hour_of_day", "avg_num_bikes_available", "geometry"]]
-
-    # filter by hour
-    df_hour = df[df["hour_of_day"] == hour_slider]
+    # filter by hour, districts without stations have no bikes
+    layer = builders.availability(store, hour_slider)
 
     # create colormap
-    linear = cm.linear.YlGnBu_09.scale(
-        df_hour["avg_num_bikes_available"].min(),
-        df_hour["avg_num_bikes_available"].max(),
-    )
+    linear = cm.linear.YlGnBu_09.scale(layer["min"], layer["max"])
     m.add_child(linear)
 
     def style_function(feature):
@@ -752,8 +690,7 @@ if "Verfügbarkeit-Fahrräder" in selected:
             "fillOpacity": 0.7,
         }
 
-    df_hour = convert_to_global_crs(df_hour)
-    feature_collection = df_hour.__geo_interface__
+    feature_collection = layer.payload
     highlight_function = lambda x: {"weight": 3, "color": "black"}
 
     # Adjust the tooltip to use selected_density for dynamic information display
@@ -774,15 +711,10 @@ if "Verfügbarkeit-Fahrräder" in selected:
 
     st.sidebar.metric(
         f"Durchschnittliche Verfügbarkeit für {hour_slider} Uhr",
-        round(df_hour["avg_num_bikes_available"].mean(), 2),
+        layer["overall"],
     )
 
-    hourly_data = (
-        df.groupby("hour_of_day")["avg_num_bikes_available"].mean().reset_index()
-    )
-    hourly_data["hour_of_day"] = pd.to_numeric(
-        hourly_data["hour_of_day"], errors="coerce"
-    )
+    hourly_data = layer["hourly"]
     hourly_data.rename(
         columns={"avg_num_bikes_available": "Anzahl", "hour_of_day": "Uhrzeit"},
         inplace=True,
@@ -797,20 +729,70 @@ if "Verfügbarkeit-Fahrräder" in selected:
 
     st.sidebar.divider()
 
+# the live bikes are sent as separate feature group, a refresh does not
+# re-render the rest of the map. the group is always sent with all bikes,
+# streamlit-folium cannot apply a delta in the browser
+live_group = None
+if "Fahrräder-Live" in selected:
+    live = load_live_bikes()
+    if st.sidebar.button("Fahrräder aktualisieren"):
+        live.poll()
+    version, bikes = live.snapshot()
+
+    st.sidebar.markdown("### Fahrräder-Live")
+    if live.error is not None:
+        st.sidebar.warning(
+            "Die freien Fahrräder konnten nicht abgefragt werden, die Karte zeigt die letzte erfolgreiche Abfrage."
+        )
+    st.sidebar.metric("Freie Fahrräder", bikes.shape[0])
+    st.sidebar.write(
+        "Die Karte zeigt die freien Fahrräder der letzten Abfrage, die Positionen werden regelmässig aktualisiert."
+    )
+
+    # the feature group is only rebuilt when a poll changed the bikes
+    if st.session_state.get("live_version") != version:
+        live_group = folium.FeatureGroup(name="Fahrräder-Live")
+        folium.GeoJson(
+            live.geojson(),
+            marker=folium.CircleMarker(radius=4, color="red", fill=True, fill_opacity=0.8),
+            tooltip=GeoJsonTooltip(fields=["bike_id"], aliases=["Bike: "]),
+        ).add_to(live_group)
+        st.session_state["live_version"] = version
+        st.session_state["live_group"] = live_group
+    live_group = st.session_state["live_group"]
+    st.sidebar.divider()
+
 ##### Render Map #####
 center = None
 if st.session_state["location"]:
     center = st.session_state["location"]
 
-map_data = st_folium(
-    m,
-    center=center,
-    use_container_width=True,
-    returned_objects=["last_clicked"],
-    key="map",
-)
+# the size of the map html costs an extra serialization, only in debug mode
+if debug:
+    with span("map.serialize") as current:
+        current.set(bytes=len(m.get_root().render().encode("utf-8")))
+
+with span("map.render"):
+    map_data = st_folium(
+        m,
+        center=center,
+        zoom=zoom,
+        use_container_width=True,
+        returned_objects=["last_clicked", "zoom"],
+        feature_group_to_add=live_group,
+        key="map",
+    )
+
+# the zoom the browser reports, the value stays the same until it zooms again.
+# the layers are rebuilt only when it crosses into another level of detail
+reported_zoom = map_data.get("zoom")
+if reported_zoom is not None and reported_zoom != st.session_state.get("reported_zoom"):
+    st.session_state["reported_zoom"] = reported_zoom
+    st.session_state["zoom"] = reported_zoom
+    if level_for_zoom(reported_zoom) != level_for_zoom(zoom):
+        st.rerun()
 
-# update map based on zoom or last clicked
+# update map based on last clicked
 if "Nächste-Station" in selected:
     if (
         map_data["last_clicked"]
@@ -820,11 +802,6 @@ if "Nächste-Station" in selected:
         st.session_state["zoom"] = 16
         st.rerun()
 
-# if "Nächste-Station" not in selected:
-#     if st.session_state["zoom"] == 16:
-#         st.session_state["zoom"] = 15
-#         st.rerun()
-
 
 # add footer
 
@@ -844,3 +821,22 @@ st.sidebar.markdown(
 - [Openstreetmap](https://www.openstreetmap.org/)
 """
 )
+
+if debug:
+    with st.sidebar.expander("Debug: Zeitmessung", expanded=True):
+        st.metric("Dauer dieses Durchlaufs (in ms)", round(trace.duration * 1000, 1))
+        spans = pd.DataFrame(trace.to_records())
+        if not spans.empty:
+            spans["duration"] = (spans["duration"] * 1000).round(2)
+            spans = spans.rename(columns={"duration": "ms"})
+            st.dataframe(spans, use_container_width=True, hide_index=True)
+        query_costs = pd.DataFrame(costs.to_records())
+        if not query_costs.empty:
+            st.caption("BigQuery-Kosten seit dem Start (in Bytes)")
+            st.dataframe(query_costs, use_container_width=True, hide_index=True)
+        st.download_button(
+            "Metriken (OpenMetrics)",
+            stats.openmetrics(extra=costs.openmetrics()),
+            file_name="metrics.txt",
+            mime="text/plain",
+        )
@@ -0,0 +1,85 @@
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pytest.importorskip("google.cloud.bigquery")
+
+from google.api_core.exceptions import ServiceUnavailable  # noqa: E402
+from data.sharedmobility import backends  # noqa: E402
+from data.sharedmobility.backends import BigQueryBackend  # noqa: E402
+from data.sharedmobility.client import BigQueryClientPool  # noqa: E402
+
+
+class FakeJob:
+    total_bytes_processed = 0
+    total_bytes_billed = 0
+    slot_millis = 0
+    cache_hit = False
+
+    def __init__(self, batches):
+        self.batches = batches
+
+    def result(self, **options):
+        return self
+
+    def to_arrow_iterable(self, bqstorage_client=None):
+        yield from self.batches
+
+
+class FakeClient:
+    def __init__(self, batches=()):
+        self.batches = list(batches)
+        self.closed = False
+
+    def query(self, query, job_config=None):
+        return FakeJob(self.batches)
+
+    def close(self):
+        self.closed = True
+
+
+def fake_pool(client):
+    return BigQueryClientPool(factory=lambda: client, size=1, health_check=lambda c: True)
+
+
+@pytest.fixture(autouse=True)
+def no_storage_api(monkeypatch):
+    monkeypatch.setattr(backends, "bigquery_storage", None)
+
+
+def test_iter_batches_closed_early_releases_client():
+    batches = [pa.record_batch([pa.array([i])], names=["value"]) for i in range(3)]
+    client = FakeClient(batches)
+    pool = fake_pool(client)
+
+    stream = BigQueryBackend(pool).iter_batches("SELECT 1")
+    assert next(stream).column(0).to_pylist() == [0]
+    stream.close()
+
+    # the only client of the pool is available again and not replaced
+    assert pool.acquire(timeout=1) is client
+    assert not client.closed
+    assert pool.created == 1
+
+
+def test_query_error_releases_client():
+    client = FakeClient()
+    pool = fake_pool(client)
+
+    with pytest.raises(ValueError):
+        with pool.connection():
+            raise ValueError("Syntax error")
+
+    assert pool.acquire(timeout=1) is client
+    assert not client.closed
+
+
+def test_client_failure_replaces_client():
+    client = FakeClient()
+    pool = fake_pool(client)
+
+    with pytest.raises(ServiceUnavailable):
+        with pool.connection():
+            raise ServiceUnavailable("connection reset")
+
+    assert client.closed
+    assert pool.created == 0
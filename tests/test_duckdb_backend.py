@@ -0,0 +1,146 @@
+from datetime import datetime, timedelta, timezone
+import threading
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+pd = pytest.importorskip("pandas")
+
+from data.cache import ParquetCache, get_cache, set_cache  # noqa: E402
+from data.sharedmobility import (  # noqa: E402
+    DuckDBBackend,
+    bigquery_station_status,
+    bigquery_unique_stations,
+    set_backend,
+)
+from data.sharedmobility.backends import (  # noqa: E402
+    duckdb_parameters,
+    translate_bigquery_sql,
+)
+
+CRAWLS = [datetime(2024, 5, 1, 10), datetime(2024, 5, 3, 10)]
+
+
+def local_backend(directory):
+    try:
+        return DuckDBBackend(str(directory))
+    except duckdb.Error as e:
+        pytest.skip(f"the duckdb spatial extension is not available: {e}")
+
+
+def plain_backend(directory):
+    # the backend without the spatial extension, enough for tables without geometry
+    backend = object.__new__(DuckDBBackend)
+    backend.directory = str(directory)
+    backend._con = duckdb.connect()
+    backend._lock = threading.Lock()
+    backend.tables = set()
+    return backend
+
+
+@pytest.fixture(params=[None, "UTC"], ids=["naive", "utc"])
+def backend(request, tmp_path):
+    # pandas writes naive datetimes as plain TIMESTAMP, tz-aware ones as TIMESTAMPTZ
+    crawl_time = pd.Series(CRAWLS)
+    if request.param:
+        crawl_time = crawl_time.dt.tz_localize(request.param)
+    pd.DataFrame(
+        {
+            "station_id": ["1_nextbike", "2_nextbike"],
+            "provider_id": ["nextbike", "nextbike"],
+            "num_bikes_available": [3, 5],
+            "crawl_time": crawl_time,
+        }
+    ).to_parquet(tmp_path / "station_status.parquet")
+    pd.DataFrame(
+        {
+            "station_id": ["1_nextbike", "2_nextbike"],
+            "name": ["Bahnhof", "Kasernenplatz"],
+            "lat": [47.05, 47.06],
+            "lon": [8.31, 8.30],
+            "crawl_time": crawl_time,
+        }
+    ).to_parquet(tmp_path / "station_information.parquet")
+
+    backend = local_backend(tmp_path)
+    cache = get_cache()
+    set_cache(ParquetCache(str(tmp_path / "cache")))
+    set_backend(backend)
+    yield backend
+    set_backend(None)
+    set_cache(cache)
+
+
+def test_station_status_window(backend):
+    frames = list(bigquery_station_status("2024-05-01"))
+    status = pd.concat(frames)
+    assert status["station_id"].tolist() == ["1_nextbike"]
+
+
+def test_unique_stations_window(backend):
+    stations = bigquery_unique_stations(start="2024-05-02", end="2024-05-04")
+    assert stations["name"].tolist() == ["Kasernenplatz"]
+
+
+def test_latest_snapshot_naive_timestamps(tmp_path):
+    from data.sharedmobility.snapshot import LatestSnapshot, SQL_LATEST_FREE_BIKE_STATUS
+
+    pd.DataFrame(
+        {
+            "bike_id": ["a", "b", "a"],
+            "lat": [47.05, 47.06, 47.07],
+            "lon": [8.31, 8.30, 8.29],
+            "crawl_time": [CRAWLS[0], CRAWLS[0], CRAWLS[1]],
+        }
+    ).to_parquet(tmp_path / "nextbike_free_bike_status.parquet")
+    backend = local_backend(tmp_path)
+
+    # the crawls are older than the lookback, so the whole table is searched once
+    snapshot = LatestSnapshot(SQL_LATEST_FREE_BIKE_STATUS, ttl=0)
+    bikes = snapshot.get(backend)
+    assert bikes["bike_id"].tolist() == ["a"]
+    assert snapshot.watermark.isoformat() == "2024-05-03T10:00:00+00:00"
+
+    # later fetches start at the watermark
+    assert snapshot.get(backend)["bike_id"].tolist() == ["a"]
+    backend.close()
+
+
+def test_translate_bigquery_sql():
+    query = translate_bigquery_sql(
+        "SELECT ST_GEOGPOINT(lon, lat) AS geometry "
+        "FROM `seli-data-storage.data_storage_1.station_status` "
+        "WHERE crawl_time > @since AND crawl_time <= @until_time"
+    )
+    assert query == (
+        "SELECT ST_Point(lon, lat) AS geometry "
+        "FROM station_status "
+        "WHERE crawl_time > $since AND crawl_time <= $until_time"
+    )
+
+
+def test_duckdb_parameters():
+    summer = timezone(timedelta(hours=2))
+    params = duckdb_parameters(
+        {"since": datetime(2024, 5, 1, 12, tzinfo=summer), "until": CRAWLS[1], "id": "1"}
+    )
+    assert params == {"since": datetime(2024, 5, 1, 10), "until": CRAWLS[1], "id": "1"}
+    assert duckdb_parameters(None) is None
+
+
+def test_timestamptz_stored_as_naive_utc(tmp_path):
+    crawl_time = pd.Series(CRAWLS).dt.tz_localize("UTC").dt.tz_convert("Europe/Zurich")
+    pd.DataFrame({"station_id": ["1", "2"], "crawl_time": crawl_time}).to_parquet(
+        tmp_path / "station_status.parquet"
+    )
+    backend = plain_backend(tmp_path)
+    assert backend._load_table("station_status")
+
+    since = datetime(2024, 5, 2, tzinfo=timezone.utc)
+    status = backend.query_df(
+        "SELECT * FROM `seli-data-storage.data_storage_1.station_status` "
+        "WHERE crawl_time > @since",
+        params={"since": since},
+    )
+    assert status["station_id"].tolist() == ["2"]
+    assert status["crawl_time"].tolist() == [pd.Timestamp(CRAWLS[1])]
+    backend.close()
@@ -0,0 +1,110 @@
+import io
+import math
+import urllib.error
+import urllib.request
+import pytest
+
+gpd = pytest.importorskip("geopandas")
+Image = pytest.importorskip("PIL.Image")
+
+from data.store import DatasetStore  # noqa: E402
+from layers.tiles import (  # noqa: E402
+    EMPTY_TILE,
+    ORIGIN,
+    TILE_SIZE,
+    TileRenderer,
+    TileServer,
+    station_tiles,
+    tile_bounds,
+)
+
+# Luzern, Bahnhof
+LON, LAT = 8.31, 47.05
+ZOOM = 14
+
+
+def tile_of(lon, lat, z):
+    n = 2**z
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return x, y
+
+
+def stations():
+    return gpd.GeoDataFrame(
+        {"name": ["Bahnhof"], "lat": [LAT], "lon": [LON]},
+        geometry=gpd.points_from_xy([LON], [LAT]),
+        crs="EPSG:4326",
+    )
+
+
+def decode(tile):
+    image = Image.open(io.BytesIO(tile))
+    assert image.size == (TILE_SIZE, TILE_SIZE)
+    return image.convert("RGBA")
+
+
+def test_tile_bounds():
+    assert tile_bounds(0, 0, 0) == pytest.approx((-ORIGIN, -ORIGIN, ORIGIN, ORIGIN))
+    assert tile_bounds(1, 1, 0) == pytest.approx((0, 0, ORIGIN, ORIGIN))
+    assert tile_bounds(1, 0, 1) == pytest.approx((-ORIGIN, -ORIGIN, 0, 0))
+
+
+def test_empty_tile():
+    renderer = TileRenderer(stations(), fill=(255, 0, 0, 255))
+    x, y = tile_of(LON, LAT, ZOOM)
+    tile = renderer.render(ZOOM, x + 10, y)
+    assert tile == EMPTY_TILE
+    assert decode(tile).getextrema()[3] == (0, 0)
+
+
+def test_rendered_tile():
+    renderer = TileRenderer(stations(), fill=(255, 0, 0, 255), radius=5)
+    x, y = tile_of(LON, LAT, ZOOM)
+    image = decode(renderer.render(ZOOM, x, y))
+    pixels = [
+        (px, py)
+        for px in range(TILE_SIZE)
+        for py in range(TILE_SIZE)
+        if image.getpixel((px, py)) == (255, 0, 0, 255)
+    ]
+    assert pixels
+    # one dot of about the radius
+    xs, ys = zip(*pixels)
+    assert max(xs) - min(xs) <= 10 and max(ys) - min(ys) <= 10
+
+
+@pytest.fixture
+def server():
+    store = DatasetStore({"unique_stations": stations()})
+    server = TileServer(lambda: store, host="127.0.0.1", port=0).start()
+    yield server, store
+    server.stop()
+
+
+def fetch(server, path):
+    port = server._server.server_address[1]
+    return urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=10)
+
+
+def test_server_tile(server):
+    server, store = server
+    x, y = tile_of(LON, LAT, ZOOM)
+    url = server.url("stations", store, base_url="")
+    response = fetch(server, url.format(z=ZOOM, x=x, y=y))
+    assert response.headers["Content-Type"] == "image/png"
+    assert "immutable" in response.headers["Cache-Control"]
+    assert response.read() == station_tiles(store).render(ZOOM, x, y)
+    assert len(server.cache) == 1
+
+
+def test_server_render_error(server):
+    server, store = server
+
+    def broken():
+        raise RuntimeError("reloading")
+
+    server.get_store = broken
+    with pytest.raises(urllib.error.HTTPError) as error:
+        fetch(server, f"/stations/0/{ZOOM}/0/0.png")
+    assert error.value.code == 500